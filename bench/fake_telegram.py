@@ -0,0 +1,404 @@
+"""
+Local stand-in for the t.me web preview, serving synthetic channels in the markup the
+parsers expect:
+
+    GET  /s/{channel}                    channel feed (latest page)
+    GET  /s/{channel}?q={query}          search results, paginated like the feed
+    POST /s/{channel}?before={id}        XHR pagination, JSON encoded html fragment
+    GET  /{channel}/{id}?embed=1&single=1  single post embed
+    GET  /__stats                        request counters of this server
+
+Any channel name is served; its posts are generated deterministically from the seed.
+
+    $ python -m bench.fake_telegram --port 8080 --posts 1000 --latency 0.05 --rate-limit-rate 0.01
+"""
+import json
+import time
+import random
+import zlib
+import argparse
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+
+
+DEFAULT_MIX = dict(text=4, photo=3, video=1, audio=1, poll=1, album=1, forwarded=2, reply=1)
+POST_INTERVAL = timedelta(minutes=7)
+
+MESSAGE = '''<div class="tgme_widget_message_wrap js-widget_message_wrap"><div class="tgme_widget_message js-widget_message" data-post="{channel}/{id}" data-view="eyJjIjotMTAwMTIzNDU2Nzg5fQ" data-peer="c{peer}_-8113249853027155210" data-peer-hash="4f1c2a9e7b3d5a11">
+  <div class="tgme_widget_message_user"><a href="{base}/{channel}"><i class="tgme_widget_message_user_photo bgcolor2" data-content="SY"><img src="{base}/file/{channel}_avatar.jpg"></i></a></div>
+  <div class="tgme_widget_message_bubble">
+    <div class="tgme_widget_message_author accent_color"><a class="tgme_widget_message_owner_name" href="{base}/{channel}"><span dir="auto">{title}</span></a></div>
+    {header}{media}<div class="tgme_widget_message_text js-message_text" dir="auto">{text}</div>
+    <div class="tgme_widget_message_footer compact js-message_footer">
+      <div class="tgme_widget_message_info short js-message_info">
+        {voters}<span class="tgme_widget_message_views">{views}</span><span class="copyonly"> views</span><span class="tgme_widget_message_meta"><a class="tgme_widget_message_date" href="{base}/{channel}/{id}"><time datetime="{datetime}" class="time">{time}</time></a></span>
+      </div>
+    </div>
+  </div>
+</div></div>
+'''
+
+PHOTO = '''<a class="tgme_widget_message_photo_wrap" href="{base}/{channel}/{id}" style="width:800px;background-image:url('{base}/file/{channel}_{id}.jpg')">
+      <div class="tgme_widget_message_photo" style="padding-top:75%"></div>
+    </a>
+    '''
+
+VIDEO = '''<a class="tgme_widget_message_video_player js-message_video_player" href="{base}/{channel}/{id}">
+      <i class="tgme_widget_message_video_thumb" style="background-image:url('{base}/file/{channel}_{id}_thumb.jpg')"></i>
+      <div class="tgme_widget_message_video_wrap" style="width:720px;padding-top:56.25%">
+        <video src="{base}/file/{channel}_{id}.mp4" class="tgme_widget_message_video js-message_video" width="100%" height="100%"></video>
+      </div>
+      <time class="message_video_duration js-message_video_duration">{duration}</time>
+    </a>
+    '''
+
+AUDIO = '''<div class="tgme_widget_message_document_wrap">
+      <div class="tgme_widget_message_document_icon accent_bg audio"><i></i></div>
+      <div class="tgme_widget_message_document">
+        <div class="tgme_widget_message_document_title accent_color" dir="auto">Episode {id}</div>
+        <div class="tgme_widget_message_document_extra" dir="auto">{title} Radio</div>
+      </div>
+    </div>
+    '''
+
+POLL = '''<div class="tgme_widget_message_poll js-poll">
+      <div class="tgme_widget_message_poll_question" dir="auto">Question number {id}?</div>
+      <div class="tgme_widget_message_poll_type">Anonymous Poll</div>
+      <div class="tgme_widget_message_poll_option"><div class="tgme_widget_message_poll_option_text" dir="auto">Yes</div></div>
+      <div class="tgme_widget_message_poll_option"><div class="tgme_widget_message_poll_option_text" dir="auto">No</div></div>
+    </div>
+    '''
+
+ALBUM = '''<div class="tgme_widget_message_grouped_wrap js-message_grouped_wrap" style="width:453px;">
+      <div class="tgme_widget_message_grouped js-message_grouped"><div class="tgme_widget_message_grouped_layer js-message_grouped_layer">
+        {items}
+      </div></div>
+    </div>
+    '''
+
+ALBUM_ITEM = '''<a class="tgme_widget_message_photo_wrap grouped_media_wrap blured js-message_photo" style="width:225px;background-image:url('{base}/file/{channel}_{id}.jpg')" href="{base}/{channel}/{id}?single"></a>'''
+
+FORWARDED = '''<div class="tgme_widget_message_forwarded_from accent_color">Forwarded from <a class="tgme_widget_message_forwarded_from_name" href="{base}/{origin_channel}/{origin_id}"><span dir="auto">{origin_channel}</span></a></div>
+    '''
+
+REPLY = '''<a class="tgme_widget_message_reply" href="{base}/{channel}/{reply_to}">
+      <div class="tgme_widget_message_author accent_color"><span class="tgme_widget_message_author_name" dir="auto">{title}</span></div>
+      <div class="tgme_widget_message_metatext js-message_reply_text" dir="auto">Earlier post {reply_to}</div>
+    </a>
+    '''
+
+FEED = '''<!DOCTYPE html>
+<html>
+  <head>
+    <meta charset="utf-8">
+    <title>{title} – Telegram</title>
+    {prev}
+  </head>
+  <body class="widget_frame_base tgme_webpreview_body">
+    <div class="tgme_channel_info">
+      <div class="tgme_channel_info_header">
+        <i class="tgme_page_photo_image bgcolor2" data-content="SY"><img src="{base}/file/{channel}_avatar.jpg"></i>
+        <div class="tgme_channel_info_header_title"><span dir="auto">{title}</span></div>
+        <div class="tgme_channel_info_header_username"><a href="{base}/{channel}">@{channel}</a></div>
+      </div>
+      <div class="tgme_channel_info_description">Synthetic channel with {posts} posts</div>
+      <div class="tgme_channel_info_counters">
+        <div class="tgme_channel_info_counter"><span class="counter_value">{subscribers}</span> <span class="counter_type">subscribers</span></div>
+      </div>
+    </div>
+    <section class="tgme_channel_history js-message_history">
+{messages}    </section>
+  </body>
+</html>
+'''
+
+EMBED = '''<!DOCTYPE html>
+<html>
+  <head><meta charset="utf-8"><title>{title}</title></head>
+  <body class="body_widget_post emoji_image nodark">
+{message}  </body>
+</html>
+'''
+
+PREVIEW = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Telegram: Contact @{channel}</title></head>
+<body><div class="tgme_page"><div class="tgme_page_title"><span dir="auto">{channel}</span></div></div></body></html>
+'''
+
+
+class SyntheticChannel(object):
+
+    def __init__(self, name, posts, mix, seed=0, now=None):
+        self.name = name
+        self.title = name.capitalize()
+        self.peer = 1000000000 + zlib.crc32(name.encode()) % 1000000000
+        self.now = now or datetime.now(tz=timezone.utc).replace(microsecond=0)
+        self.rng = random.Random(f'{seed}-{name}')
+        self.posts = dict()
+        # feed entries are single posts or whole albums, identified by their last message id
+        self.entries = []
+        self._generate(posts, mix)
+
+    def _generate(self, count, mix):
+        types, weights = zip(*mix.items())
+        message_id = 1
+        while message_id <= count:
+            post_type = self.rng.choices(types, weights)[0]
+            post = dict(id=message_id, type=post_type, views=self.rng.randint(10, 2000000))
+            if post_type == 'album':
+                size = min(self.rng.randint(2, 4), count - message_id + 1)
+                post['group'] = list(range(message_id, message_id + size))
+                for item_id in post['group']:
+                    self.posts[item_id] = dict(id=item_id, type='photo', views=post['views'], album=post)
+                message_id += size
+                post['id'] = post['group'][-1]
+            else:
+                if post_type == 'forwarded':
+                    post['origin_channel'] = f'origin{self.rng.randint(0, 49)}'
+                    post['origin_id'] = self.rng.randint(1, max(count, 1))
+                elif post_type == 'reply':
+                    post['reply_to'] = self.rng.randint(1, message_id - 1) if message_id > 1 else None
+                self.posts[message_id] = post
+                message_id += 1
+            self.entries.append(post)
+        last_id = message_id - 1
+        for message_id, post in self.posts.items():
+            post['datetime'] = self.now - POST_INTERVAL * (last_id - message_id)
+        for entry in self.entries:
+            entry['datetime'] = self.posts[entry['id']]['datetime']
+
+    def page(self, before=None, size=20, query=None):
+        entries = [entry for entry in self.entries
+                   if (before is None or entry['id'] < before) and (query is None or self.matches(entry, query))]
+        return entries[-size:], len(entries) > size
+
+    def matches(self, entry, query):
+        # mirrors the text rendered by `render`
+        return query.lower() in f'post {entry["id"]} of {self.title} #{self.name} #{entry["type"]}'.lower()
+
+    def render(self, post, base):
+        fields = dict(base=base, channel=self.name, title=self.title, peer=self.peer, id=post['id'],
+                      views=shorthand(post['views']), datetime=post['datetime'].isoformat(),
+                      time=post['datetime'].strftime('%H:%M'), header='', media='', voters='',
+                      text=f'Post {post["id"]} of {self.title} #{self.name} #{post["type"]}')
+        post_type = post['type']
+        if post_type == 'photo':
+            fields['media'] = PHOTO.format(**fields)
+        elif post_type == 'video':
+            fields['media'] = VIDEO.format(duration=f'{post["id"] % 60}:{post["id"] % 60:02d}', **fields)
+        elif post_type == 'audio':
+            fields['media'] = AUDIO.format(**fields)
+        elif post_type == 'poll':
+            fields['media'] = POLL.format(**fields)
+            fields['voters'] = f'<span class="tgme_widget_message_voters">{shorthand(post["views"] // 10)}</span>'
+        elif post_type == 'album':
+            items = ''.join(ALBUM_ITEM.format(base=base, channel=self.name, id=item_id) for item_id in post['group'])
+            fields['media'] = ALBUM.format(items=items)
+        elif post_type == 'forwarded':
+            fields['header'] = FORWARDED.format(base=base, origin_channel=post['origin_channel'],
+                                                origin_id=post['origin_id'])
+        elif post_type == 'reply' and post['reply_to']:
+            fields['header'] = REPLY.format(reply_to=post['reply_to'], **fields)
+        return MESSAGE.format(**fields)
+
+    def render_feed(self, base, size=20, query=None):
+        entries, has_more = self.page(size=size, query=query)
+        search = f'{urlencode(dict(q=query))}&' if query else ''
+        prev = f'<link rel="prev" href="/s/{self.name}?{search}before={entries[0]["id"]}">' if has_more and entries else ''
+        return FEED.format(base=base, channel=self.name, title=self.title, prev=prev, posts=len(self.posts),
+                           subscribers=shorthand(self.peer % 2000000),
+                           messages=''.join(self.render(entry, base) for entry in entries))
+
+    def render_more(self, base, before, size=20, query=None):
+        entries, has_more = self.page(before=before, size=size, query=query)
+        search = f'{urlencode(dict(q=query))}&' if query else ''
+        more = ''
+        if has_more and entries:
+            more = (f'<a href="/s/{self.name}?{search}before={entries[0]["id"]}" class="tme_messages_more js-messages_more"'
+                    f' data-before="{entries[0]["id"]}"></a>\n')
+        return json.dumps(more + ''.join(self.render(entry, base) for entry in entries))
+
+    def render_single(self, base, message_id):
+        post = self.posts.get(message_id)
+        if post is None:
+            return None
+        return EMBED.format(title=self.title, message=self.render(post, base))
+
+
+def shorthand(number):
+    if number >= 1000000:
+        return f'{number / 1000000:.1f}M'
+    if number >= 1000:
+        return f'{number / 1000:.1f}K'
+    return str(number)
+
+
+class FakeTelegramServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, posts=200, mix=None, page_size=20, latency=0.0, jitter=0.0,
+                 error_rate=0.0, rate_limit_rate=0.0, redirect_rate=0.0, seed=0):
+        super().__init__(address, FakeTelegramHandler)
+        self.posts = posts
+        self.mix = mix or DEFAULT_MIX
+        self.page_size = page_size
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.redirect_rate = redirect_rate
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.channels = dict()
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def channel(self, name):
+        with self.lock:
+            if name not in self.channels:
+                self.channels[name] = SyntheticChannel(name, self.posts, self.mix, seed=self.seed)
+            return self.channels[name]
+
+    def roll(self, rate):
+        with self.lock:
+            return self.rng.random() < rate
+
+    def delay(self):
+        if self.latency or self.jitter:
+            with self.lock:
+                extra = self.rng.uniform(0, self.jitter) if self.jitter else 0
+            time.sleep(self.latency + extra)
+
+    def count(self, *keys, amount=1):
+        with self.lock:
+            for key in keys:
+                self.stats[key] += amount
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _handle(self, method):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        query = parse_qs(url.query)
+
+        if url.path == '/__stats':
+            return self._send(200, json.dumps(self.server.stats), 'application/json', count=False)
+
+        route = self._route(method, parts, query)
+        self.server.count('requests', f'route:{route}')
+        self.server.delay()
+        if route == 'unknown':
+            return self._send(404, 'Not Found')
+        if self.server.roll(self.server.error_rate):
+            return self._send(500, 'Internal Server Error')
+        if self.server.roll(self.server.rate_limit_rate):
+            return self._send(429, 'Too Many Requests', headers={'Retry-After': '1'})
+
+        base = self.server.base_url
+        search = query['q'][0] if 'q' in query else None
+        if route in ('feed', 'search'):
+            channel = self.server.channel(parts[1])
+            if self.server.roll(self.server.redirect_rate):
+                return self._send(302, '', headers={'Location': f'{base}/{channel.name}'})
+            return self._send(200, channel.render_feed(base, size=self.server.page_size, query=search))
+        if route == 'load_more':
+            channel = self.server.channel(parts[1])
+            return self._send(200, channel.render_more(base, int(query['before'][0]), size=self.server.page_size,
+                                                       query=search),
+                              'application/json')
+        if route == 'single_post':
+            content = self.server.channel(parts[0]).render_single(base, int(parts[1]))
+            return self._send(200, content) if content else self._send(404, 'Not Found')
+        return self._send(200, PREVIEW.format(channel=parts[0]))
+
+    @staticmethod
+    def _route(method, parts, query):
+        if len(parts) == 2 and parts[0] == 's':
+            if 'before' in query:
+                return 'load_more'
+            return 'search' if 'q' in query else 'feed'
+        if len(parts) == 2 and parts[1].isdigit():
+            return 'single_post'
+        if len(parts) == 1 and method == 'GET':
+            return 'preview'
+        return 'unknown'
+
+    def _send(self, status, body, content_type='text/html; charset=utf-8', headers=None, count=True):
+        body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        if count:
+            self.server.count(f'status:{status}')
+            self.server.count('bytes', amount=len(body))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def parse_mix(value):
+    mix = dict()
+    for item in value.split(','):
+        post_type, weight = item.split('=')
+        if post_type not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f'unknown post type {post_type}')
+        mix[post_type] = float(weight)
+    return mix
+
+
+def add_server_arguments(arg_parser):
+    arg_parser.add_argument('--posts', type=int, default=200, help='posts per channel')
+    arg_parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                            help='post type weights, e.g. text=4,photo=3,album=1,forwarded=2')
+    arg_parser.add_argument('--page-size', type=int, default=20)
+    arg_parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    arg_parser.add_argument('--jitter', type=float, default=0.0, help='random extra latency, up to seconds')
+    arg_parser.add_argument('--error-rate', type=float, default=0.0, help='share of 500 responses')
+    arg_parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='share of 429 responses')
+    arg_parser.add_argument('--redirect-rate', type=float, default=0.0, help='share of redirected feed requests')
+    arg_parser.add_argument('--seed', type=int, default=0)
+
+
+def server_kwargs(args):
+    return dict(posts=args.posts, mix=args.mix, page_size=args.page_size, latency=args.latency,
+                jitter=args.jitter, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                redirect_rate=args.redirect_rate, seed=args.seed)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=8080)
+    add_server_arguments(arg_parser)
+    args = arg_parser.parse_args(argv)
+
+    server = FakeTelegramServer((args.host, args.port), **server_kwargs(args))
+    print(f'fake telegram web serving on {server.base_url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""
+Offline parser/transform benchmarks over the recorded page corpus in bench/corpus.
+
+    $ python -m bench.parsers                    # compare against bench/baseline.json
+    $ python -m bench.parsers --update-digests   # accept intended output changes only
+    $ python -m bench.parsers --update-baseline  # store digests and rates as baseline
+
+Every benchmark reports messages/sec and a digest of its output; the run fails when an
+output digest changes. Rates are machine dependent, so they are compared relative to a
+calibration loop timed in the same process, and a drop of more than --tolerance is only
+reported, unless --strict makes it fail the run too.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import hashlib
+import argparse
+import statistics
+
+from src.models import serialize
+from src.transform import TransformerMixin
+from src.telegram_web import TelegramWebChannelParser, TelegramWebMessageParser
+
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), 'corpus')
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def load_corpus(corpus_dir=CORPUS_DIR):
+    feeds = [open(os.path.join(corpus_dir, 'feed.html')).read()]
+    # load-more responses are JSON encoded html fragments
+    for file_name in sorted(glob.glob(os.path.join(corpus_dir, 'load_more*.json'))):
+        feeds.append(json.load(open(file_name)))
+    singles = dict()
+    for file_name in sorted(glob.glob(os.path.join(corpus_dir, 'single_*.html'))):
+        singles[os.path.basename(file_name)] = open(file_name).read()
+    return dict(feeds=feeds, singles=singles)
+
+
+def parse_corpus(corpus):
+    """
+    Builds the inputs of the transform stage the way get_history does: feed messages
+    with their album items and forwarded origins resolved from the single post pages.
+    """
+    singles = dict()
+    for content in corpus['singles'].values():
+        parser = TelegramWebMessageParser(content=content)
+        message = parser.parse()
+        message['channel_id'] = parser.extract_channel_id()
+        singles[message['link']] = message
+
+    items = []
+    for page in corpus['feeds']:
+        for soup in TelegramWebChannelParser(content=page).extract_messages():
+            parser = TelegramWebMessageParser(soup=soup)
+            message = parser.parse()
+            message['channel_id'] = parser.extract_channel_id()
+            if message['album_info']['is_album']:
+                message['album_info']['messages'] = [singles[link] for link in message['album_info']['message_links']
+                                                     if link in singles]
+            if message['forwarded_info'] and message['forwarded_info']['link'] in singles:
+                origin = singles[message['forwarded_info']['link']]
+                message['forwarded_info']['channel_id'] = origin['channel_id']
+                message['forwarded_info']['publish_datetime'] = origin['publish_datetime']
+            items.append(message)
+    return items
+
+
+def transform_inputs(items):
+    return [item['album_info']['messages'] if item['type'] == 'album' else [item] for item in items]
+
+
+def bench_channel_parser(corpus):
+    count, output = 0, []
+    for page in corpus['feeds']:
+        parser = TelegramWebChannelParser(content=page)
+        messages = parser.extract_messages()
+        output.append([parser.extract_publisher_info(), parser.extract_cursor(), len(messages)])
+        count += len(messages)
+    return count, output
+
+
+def bench_message_parser(corpus):
+    count, output = 0, []
+    for soup in corpus['message_soups']:
+        output.append(TelegramWebMessageParser(soup=soup).parse())
+        count += 1
+    for content in corpus['singles'].values():
+        output.append(TelegramWebMessageParser(content=content).parse())
+        count += 1
+    return count, output
+
+
+def bench_transform(inputs):
+    transformer = TransformerMixin()
+    output = [transformer.transform(objects) for objects in inputs]
+    return len(output), [serialize(value, dict()) for value in output]
+
+
+def bench_serialize(values):
+    output = [serialize(value, dict()) for value in values]
+    return len(output), output
+
+
+def digest(output):
+    return hashlib.sha256(json.dumps(output, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def calibration_loop(size=10000):
+    """
+    Fixed pure python workload (string formatting, slicing & dict churn, as in parsing)
+    whose rate scales with the interpreter & machine but not with this repo's code.
+    """
+    data = dict()
+    for i in range(size):
+        key = f'k{i % 512}'
+        data[key] = data.get(key, '')[:16] + str(i)
+    return size, None
+
+
+def measure(fn, arg, min_time=0.5, repeat=3):
+    """
+    Returns the best messages/sec over `repeat` rounds of at least `min_time` seconds each.
+    """
+    best = 0.0
+    for _ in range(repeat):
+        count = 0
+        start = time.perf_counter()
+        while True:
+            n, _ = fn(arg)
+            count += n
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = max(best, count / elapsed)
+    return best
+
+
+def run(min_time=0.5, repeat=5):
+    corpus = load_corpus()
+    # feed messages are parsed from the soups the channel parser hands out, single posts from raw html
+    corpus['message_soups'] = [soup for page in corpus['feeds']
+                               for soup in TelegramWebChannelParser(content=page).extract_messages()]
+    inputs = transform_inputs(parse_corpus(corpus))
+    transformer = TransformerMixin()
+    values = [transformer.transform(objects) for objects in inputs]
+
+    benchmarks = [
+        ('channel_parser', bench_channel_parser, corpus),
+        ('message_parser', bench_message_parser, corpus),
+        ('transform', bench_transform, inputs),
+        ('serialize', bench_serialize, values),
+    ]
+    results = dict()
+    for name, fn, arg in benchmarks:
+        rates, relative_rates = [], []
+        # the calibration loop runs right before every round, so each ratio is taken at the same machine speed
+        for _ in range(repeat):
+            calibration = measure(calibration_loop, 10000, min_time=min_time, repeat=1)
+            rates.append(measure(fn, arg, min_time=min_time, repeat=1))
+            relative_rates.append(rates[-1] / calibration)
+        results[name] = dict(
+            messages_per_sec=round(max(rates), 1),
+            relative_rate=round(statistics.median(relative_rates), 6),
+            digest=digest(fn(arg)[1])
+        )
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns (output changes, rate regressions) against the baseline.
+    """
+    changes, regressions = [], []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result['digest'] != expected['digest']:
+            changes.append(f'{name}: output changed ({expected["digest"][:12]} -> {result["digest"][:12]})')
+        if expected.get('relative_rate') is None:
+            continue
+        floor = expected['relative_rate'] * (1 - tolerance)
+        if result['relative_rate'] < floor:
+            regressions.append(f'{name}: relative rate {result["relative_rate"]} is below {floor:.6f} '
+                               f'(baseline {expected["relative_rate"]}, tolerance {tolerance:.0%})')
+    return changes, regressions
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--baseline', default=BASELINE_FILE)
+    arg_parser.add_argument('--update-baseline', action='store_true')
+    arg_parser.add_argument('--update-digests', action='store_true', help='update the output digests, keep the rates')
+    arg_parser.add_argument('--tolerance', type=float, default=0.2)
+    arg_parser.add_argument('--strict', action='store_true', help='fail on rate regressions too')
+    arg_parser.add_argument('--min-time', type=float, default=0.5)
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    args = arg_parser.parse_args(argv)
+
+    results = run(min_time=args.min_time, repeat=args.repeat)
+    baseline = json.load(open(args.baseline)) if os.path.exists(args.baseline) else dict()
+    for name, result in results.items():
+        previous = baseline.get(name, {}).get('relative_rate')
+        change = f'{(result["relative_rate"] / previous - 1):+.1%}' if previous else 'n/a'
+        print(f'{name:<16} {result["messages_per_sec"]:>12.1f} msg/s   relative rate vs baseline {change}')
+
+    if args.update_baseline or args.update_digests:
+        if args.update_digests:
+            for name, result in results.items():
+                previous = baseline.get(name)
+                if previous is not None:
+                    result.update(messages_per_sec=previous.get('messages_per_sec'),
+                                  relative_rate=previous.get('relative_rate'))
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'baseline written to {args.baseline}')
+        return 0
+
+    changes, regressions = compare(results, baseline, args.tolerance)
+    for change in changes:
+        print(f'OUTPUT CHANGED {change}')
+    for regression in regressions:
+        print(f'{"REGRESSION" if args.strict else "WARNING"} {regression}')
+    return 1 if changes or (args.strict and regressions) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Records a crawl into a cassette once and replays it offline, e.g. against a newer
+version of the engine, to compare request counts, wall-clock time and output.
+
+    $ python -m bench.replay record --cassette crawl.jsonl.gz --output recorded.jsonl bbcpersian farsna
+    $ python -m bench.replay replay --cassette crawl.jsonl.gz --expect recorded.jsonl bbcpersian farsna
+
+`replay` exits non zero when the output is not byte-identical to --expect or when the
+crawl makes requests the cassette holds no response for.
+"""
+import sys
+import time
+import hashlib
+import argparse
+
+from src.telegram_web import BASE_URL
+from src.transport import HttpTransport, RecordingTransport, ReplayTransport
+from bench.throughput import ThroughputCrawler
+
+
+class CountingTransport(HttpTransport):
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.requests = 0
+
+    def request(self, *args, **kwargs):
+        self.requests += 1
+        return self.transport.request(*args, **kwargs)
+
+    def close(self):
+        self.transport.close()
+
+
+def crawl(channels, transport, base_url, forwarded_resolution, limit):
+    crawler = ThroughputCrawler(base_url, forwarded_resolution=forwarded_resolution,
+                                transport=transport, keep_output=True)
+    start = time.perf_counter()
+    for channel in channels:
+        crawler.process(channel, limit=limit)
+    elapsed = time.perf_counter() - start
+    transport.close()
+    return crawler.output, elapsed
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('mode', choices=('record', 'replay'))
+    arg_parser.add_argument('channels', nargs='+')
+    arg_parser.add_argument('--cassette', required=True)
+    arg_parser.add_argument('--output', help='write the serialized crawl output to this file')
+    arg_parser.add_argument('--expect', help='output file the replayed output must match byte for byte')
+    arg_parser.add_argument('--realtime', action='store_true', help='replay with the recorded latencies')
+    arg_parser.add_argument('--base-url', default=BASE_URL)
+    arg_parser.add_argument('--limit', type=int, default=50)
+    arg_parser.add_argument('--forwarded-resolution', choices=('batch', 'reference'), default='batch')
+    args = arg_parser.parse_args(argv)
+
+    if args.mode == 'record':
+        inner = RecordingTransport(args.cassette)
+    else:
+        inner = ReplayTransport(args.cassette, realtime=args.realtime)
+    transport = CountingTransport(inner)
+    output, elapsed = crawl(args.channels, transport, args.base_url, args.forwarded_resolution, args.limit)
+
+    content = ''.join(f'{line}\n' for line in output).encode()
+    if args.output:
+        with open(args.output, 'wb') as f:
+            f.write(content)
+
+    print(f'records          {len(output)}')
+    print(f'requests         {transport.requests}')
+    print(f'elapsed          {elapsed:.2f} s')
+    print(f'output sha256    {hashlib.sha256(content).hexdigest()}')
+
+    failed = False
+    if args.mode == 'replay':
+        unused = sum(len(queue) for queue in inner.exchanges.values())
+        print(f'cassette misses  {inner.misses}')
+        print(f'unused exchanges {unused}')
+        failed = inner.misses > 0
+    if args.expect:
+        identical = open(args.expect, 'rb').read() == content
+        print(f'identical output {identical}')
+        failed = failed or not identical
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""
+Startup time benchmark: runs each entry point in a fresh interpreter and reports the
+median wall-clock time over `--repeat` runs, and its overhead over a bare interpreter.
+
+    $ python -m bench.startup
+    $ python -m bench.startup --repeat 20 --importtime 15 --max-cli-ms 150
+
+`--importtime` lists the slowest imports of the full crawler process (python -X importtime)
+and `--max-cli-ms` fails the run when `main.py --help` takes longer than the budget.
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY_POINTS = (
+    ('interpreter', ['-c', 'pass']),
+    ('config', ['-c', 'import config']),
+    ('src', ['-c', 'import src']),
+    ('cli --help', ['main.py', '--help']),
+    ('crawler process', ['-c', 'from src import CrawlerProcess']),
+)
+
+
+def measure(args, repeat=10):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def slowest_imports(statement, count=10):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            cwd=ROOT, check=True, stderr=subprocess.PIPE, universal_newlines=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), name.rstrip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--repeat', type=int, default=10)
+    arg_parser.add_argument('--importtime', type=int, default=0, metavar='N',
+                            help='list the N slowest imports of the crawler process')
+    arg_parser.add_argument('--max-cli-ms', type=float, default=None)
+    args = arg_parser.parse_args(argv)
+
+    results = {name: measure(entry_args, repeat=args.repeat) for name, entry_args in ENTRY_POINTS}
+    for name, seconds in results.items():
+        overhead = seconds - results['interpreter']
+        print(f'{name:<16} {seconds * 1000:>8.1f} ms   {overhead * 1000:+.1f} ms over the interpreter')
+
+    if args.importtime:
+        print('slowest imports of the crawler process (cumulative)')
+        for cumulative, name in slowest_imports('from src import CrawlerProcess', args.importtime):
+            print(f'  {cumulative / 1000:>8.1f} ms  {name}')
+
+    if args.max_cli_ms is not None and results['cli --help'] * 1000 > args.max_cli_ms:
+        print(f'REGRESSION cli --help took {results["cli --help"] * 1000:.1f} ms, budget {args.max_cli_ms} ms')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
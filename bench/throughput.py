@@ -0,0 +1,104 @@
+"""
+End-to-end throughput harness: starts the fake Telegram web server (bench/fake_telegram.py)
+in a separate process, points TelegramWebClient at it and crawls synthetic channels
+through get_history, transform and serialize.
+
+    $ python -m bench.throughput --channels 5 --posts 500 --latency 0.02 --rate-limit-rate 0.01
+    $ python -m bench.throughput --channels 5 --posts 500 --query '#video'
+
+Reports posts/sec, requests per post and the crawler's peak RSS.
+"""
+import sys
+import json
+import time
+import logging
+import resource
+import argparse
+import multiprocessing
+from urllib.request import urlopen
+
+from src.crawl import CrawlerMixin
+from src.models import serialize
+from src.transform import TransformerMixin
+from bench.fake_telegram import FakeTelegramServer, add_server_arguments, server_kwargs
+
+
+def serve(address, kwargs, ready):
+    server = FakeTelegramServer(address, **kwargs)
+    ready.put(server.base_url)
+    server.serve_forever()
+
+
+class ThroughputCrawler(CrawlerMixin, TransformerMixin):
+
+    def __init__(self, base_url, forwarded_resolution='batch', transport=None, keep_output=False):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.setLevel(logging.WARNING)
+        self.init_telegram(base_url=base_url, forwarded_resolution=forwarded_resolution, transport=transport)
+        self.saved = 0
+        self.output = [] if keep_output else None
+
+    def save(self, value):
+        json_ = json.dumps(serialize(value, dict()))
+        self.saved += 1
+        if self.output is not None:
+            self.output.append(json_)
+
+    def process(self, channel, limit=None, query=None):
+        items, publisher_info = self.get_history(channel, limit=limit, query=query)
+        for item in items:
+            if item['type'] == 'album':
+                if len(item['album_info']['messages']) > 0:
+                    self.save(self.transform(item['album_info']['messages'], publisher=publisher_info))
+            else:
+                self.save(self.transform([item], publisher=publisher_info))
+        return len(items)
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--channels', type=int, default=3, help='number of synthetic channels to crawl')
+    arg_parser.add_argument('--limit', type=int, default=None, help='posts per channel to crawl, all by default')
+    arg_parser.add_argument('--forwarded-resolution', choices=('batch', 'reference'), default='batch')
+    arg_parser.add_argument('--query', default=None, help='crawl only the search results of a keyword or #hashtag')
+    add_server_arguments(arg_parser)
+    args = arg_parser.parse_args(argv)
+
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(('127.0.0.1', 0), server_kwargs(args), ready), daemon=True)
+    server.start()
+    base_url = ready.get(timeout=30)
+
+    try:
+        crawler = ThroughputCrawler(base_url, forwarded_resolution=args.forwarded_resolution)
+        posts = 0
+        start = time.perf_counter()
+        for i in range(args.channels):
+            posts += crawler.process(f'channel{i}', limit=args.limit, query=args.query)
+        elapsed = time.perf_counter() - start
+        stats = json.load(urlopen(f'{base_url}/__stats'))
+    finally:
+        server.terminate()
+
+    requests = stats.get('requests', 0)
+    print(f'posts            {posts}')
+    print(f'saved records    {crawler.saved}')
+    print(f'elapsed          {elapsed:.2f} s')
+    print(f'posts/sec        {posts / elapsed if elapsed else 0:.1f}')
+    print(f'requests         {requests}')
+    print(f'requests/post    {requests / posts if posts else 0:.3f}')
+    for key in sorted(stats):
+        if key.startswith(('route:', 'status:')):
+            print(f'  {key:<16} {stats[key]}')
+    print(f'response bytes   {stats.get("bytes", 0)}')
+    print(f'peak RSS         {peak_rss_mb():.1f} MB')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,78 @@
-TIMEZONE = "Asia/Tehran"
-USE_PROXY = True
-PROXY_TYPE = "socks5"
-PROXY_ADDRESS = "127.0.0.1"
-PROXY_PORT = 1369
-
-INPUT_FILE = "test_channels.txt"
-MAX_POSTS_PER_CHANNEL = 50
+import os
+
+# every setting can be overridden from the environment or a .env file (ENV_FILE), main.py flags
+# are applied on top; python-dotenv is only imported when there is a file to load
+ENV_FILE = os.environ.get("ENV_FILE", ".env")
+if os.path.exists(ENV_FILE):
+    from dotenv import load_dotenv
+    load_dotenv(ENV_FILE)
+
+
+def _str(name, default):
+    return os.environ.get(name, default)
+
+
+def _bool(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _list(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def _size(name, default):
+    value = os.environ.get(name)
+    if not value:
+        return default
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+TIMEZONE = _str("TIMEZONE", "Asia/Tehran")
+USE_PROXY = _bool("USE_PROXY", True)
+PROXY_TYPE = _str("PROXY_TYPE", "socks5")
+PROXY_ADDRESS = _str("PROXY_ADDRESS", "127.0.0.1")
+PROXY_PORT = _int("PROXY_PORT", 1369)
+
+INPUT_FILE = _str("INPUT_FILE", "test_channels.txt")
+MAX_POSTS_PER_CHANNEL = _int("MAX_POSTS_PER_CHANNEL", 50)  # 0 for no limit
+REFRESH_WINDOW_HOURS = _int("REFRESH_WINDOW_HOURS", 6)
+VIEWS_CACHE_FILE = _str("VIEWS_CACHE_FILE", "views_cache.json")
+FORWARDED_RESOLUTION = _str("FORWARDED_RESOLUTION", "batch")  # "batch" or "reference"
+FORWARDED_BATCH_SIZE = _int("FORWARDED_BATCH_SIZE", 20)
+CHANNEL_IDS_FILE = _str("CHANNEL_IDS_FILE", "channel_ids.json")
+PROFILING_PORT = _int("PROFILING_PORT", 9101)
+PROFILING_HOST = _str("PROFILING_HOST", "127.0.0.1")
+PROFILING_OUTPUT_DIR = _str("PROFILING_OUTPUT_DIR", "profiles")
+PROFILING_WINDOW_SECONDS = _int("PROFILING_WINDOW_SECONDS", 30)
+TELEGRAM_BASE_URL = _str("TELEGRAM_BASE_URL", "https://t.me")
+HTTP_TRANSPORT = _str("HTTP_TRANSPORT", "live")  # "live", "record" or "replay"
+CASSETTE_FILE = _str("CASSETTE_FILE", "crawl.cassette.jsonl.gz")
+REPLAY_REALTIME = _bool("REPLAY_REALTIME", False)
+LOG_FORMAT = _str("LOG_FORMAT", "text")  # "text" or "json"
+LOG_SAMPLING_BURST = _int("LOG_SAMPLING_BURST", 5)
+LOG_SAMPLING_WINDOW = _int("LOG_SAMPLING_WINDOW", 60)
+DOWNLOAD_MEDIA = _bool("DOWNLOAD_MEDIA", False)
+MEDIA_STORE_DIR = _str("MEDIA_STORE_DIR", "media")
+MEDIA_MAX_WORKERS = _int("MEDIA_MAX_WORKERS", 8)
+MEDIA_THUMBNAIL_SIZE = _size("MEDIA_THUMBNAIL_SIZE", (320, 320))  # "320x320"
+DEDUP_IMAGES = _bool("DEDUP_IMAGES", False)
+PHASH_INDEX_DIR = _str("PHASH_INDEX_DIR", "phash_index")
+PHASH_THRESHOLD = _int("PHASH_THRESHOLD", 10)
+INDEX_POSTS = _bool("INDEX_POSTS", False)
+SEARCH_INDEX_DIR = _str("SEARCH_INDEX_DIR", "search_index")
+SEARCH_INDEX_FLUSH_POSTINGS = _int("SEARCH_INDEX_FLUSH_POSTINGS", 50000)
+SEARCH_INDEX_FLUSH_INTERVAL = _int("SEARCH_INDEX_FLUSH_INTERVAL", 60)
+SEARCH_INDEX_MERGE_FACTOR = _int("SEARCH_INDEX_MERGE_FACTOR", 4)
+SEARCH_QUERIES = _list("SEARCH_QUERIES", [])  # keywords or #hashtags crawled in "search" mode
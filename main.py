@@ -1,7 +1,122 @@
+"""
+Crawler command line entry point
+
+    $ python main.py crawl --input channels.txt --max-posts 100
+    $ python main.py crawl --query '#news' --query 'election'
+    $ python main.py refresh --log-format json
+    $ python main.py backfill --since 2021-10-01 --until 2021-11-01
+    $ python main.py bench parsers --update-baseline
+
+Settings default to config.py, which reads the environment and .env; the flags given
+here override both. Modules are imported by the mode that needs them, so short-lived
+workers and `--help` do not pay for the whole crawler.
+"""
+import sys
+import argparse
+import importlib
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
 import config
-from src import CrawlerProcess
 
 
-if __name__ == "__main__":
-    p = CrawlerProcess(file_name=config.INPUT_FILE)
+BENCHMARKS = ('parsers', 'throughput', 'replay', 'startup')
+PROXY_SCHEMES = ('socks5', 'socks5h', 'socks4', 'socks4h', 'http', 'https')
+
+
+def parse_datetime(value):
+    # dates without an offset are taken as UTC, publish datetimes are offset aware
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def parse_proxy(value):
+    proxy = urlparse(value)
+    if proxy.scheme not in PROXY_SCHEMES or not proxy.hostname or not proxy.port:
+        raise argparse.ArgumentTypeError(f'expected a {", ".join(PROXY_SCHEMES)} url with a port, got {value}')
+    return proxy
+
+
+def add_crawler_arguments(arg_parser):
+    # flags are stored under their config.py name and only set when given, see `apply_config`
+    suppress = argparse.SUPPRESS
+    arg_parser.add_argument('--input', dest='INPUT_FILE', default=suppress, help='file of channel names')
+    arg_parser.add_argument('--max-posts', dest='MAX_POSTS_PER_CHANNEL', type=int, default=suppress,
+                            help='posts per channel, 0 for no limit')
+    arg_parser.add_argument('--query', dest='SEARCH_QUERIES', action='append', default=suppress,
+                            help='crawl only posts matching a keyword or #hashtag, repeatable')
+    arg_parser.add_argument('--proxy', type=parse_proxy, default=suppress,
+                            help='proxy url, e.g. socks5://127.0.0.1:1369 or http://10.0.0.1:3128')
+    arg_parser.add_argument('--no-proxy', dest='USE_PROXY', action='store_false', default=suppress)
+    arg_parser.add_argument('--base-url', dest='TELEGRAM_BASE_URL', default=suppress)
+    arg_parser.add_argument('--forwarded-resolution', dest='FORWARDED_RESOLUTION', choices=('batch', 'reference'),
+                            default=suppress)
+    arg_parser.add_argument('--transport', dest='HTTP_TRANSPORT', choices=('live', 'record', 'replay'),
+                            default=suppress)
+    arg_parser.add_argument('--cassette', dest='CASSETTE_FILE', default=suppress)
+    arg_parser.add_argument('--log-format', dest='LOG_FORMAT', choices=('text', 'json'), default=suppress)
+    arg_parser.add_argument('--download-media', dest='DOWNLOAD_MEDIA', action='store_true', default=suppress)
+    arg_parser.add_argument('--media-workers', dest='MEDIA_MAX_WORKERS', type=int, default=suppress)
+    arg_parser.add_argument('--dedup-images', dest='DEDUP_IMAGES', action='store_true', default=suppress)
+    arg_parser.add_argument('--index-posts', dest='INDEX_POSTS', action='store_true', default=suppress)
+
+
+def build_parser():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    modes = arg_parser.add_subparsers(dest='mode', required=True)
+
+    crawl = modes.add_parser('crawl', help='crawl the latest posts of every input channel')
+    add_crawler_arguments(crawl)
+
+    refresh = modes.add_parser('refresh', help='update the view counts of recent posts')
+    add_crawler_arguments(refresh)
+    refresh.add_argument('--hours', dest='REFRESH_WINDOW_HOURS', type=int, default=argparse.SUPPRESS)
+
+    backfill = modes.add_parser('backfill', help='crawl every post published within a time window')
+    add_crawler_arguments(backfill)
+    backfill.add_argument('--since', type=parse_datetime, required=True)
+    backfill.add_argument('--until', type=parse_datetime, default=None)
+
+    bench = modes.add_parser('bench', help='run a benchmark of the bench package')
+    bench.add_argument('benchmark', choices=BENCHMARKS)
+    bench.add_argument('args', nargs=argparse.REMAINDER, help='arguments of the benchmark')
+    return arg_parser
+
+
+def apply_config(args):
+    for name, value in vars(args).items():
+        if name.isupper():
+            setattr(config, name, value)
+    if getattr(args, 'proxy', None):
+        proxy = args.proxy
+        config.USE_PROXY = True
+        config.PROXY_TYPE = proxy.scheme
+        config.PROXY_ADDRESS = proxy.hostname
+        config.PROXY_PORT = proxy.port
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.mode == 'bench':
+        return importlib.import_module(f'bench.{args.benchmark}').main(args.args) or 0
+
+    if args.mode == 'backfill' and 'MAX_POSTS_PER_CHANNEL' not in args:
+        args.MAX_POSTS_PER_CHANNEL = 0
+    apply_config(args)
+
+    from src import CrawlerProcess
+    if args.mode == 'refresh':
+        mode = 'refresh'
+    else:
+        mode = 'search' if config.SEARCH_QUERIES else 'crawl'
+    p = CrawlerProcess(file_name=config.INPUT_FILE,
+                       mode=mode,
+                       since=getattr(args, 'since', None),
+                       until=getattr(args, 'until', None))
     p.run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
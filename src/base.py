@@ -1,4 +1,5 @@
 import logging
+from contextlib import nullcontext
 
 
 class BaseModule(object):
@@ -11,3 +12,23 @@ class BaseModule(object):
 
     def _err(self, msg):
         self._log(msg, logging.ERROR)
+
+    def _time(self, histogram):
+        """
+        Times a block into one of the `CrawlerMetrics` histograms, if metrics are enabled.
+        """
+        if getattr(self, "metrics", None) is not None:
+            return getattr(self.metrics, histogram).time()
+        return nullcontext()
+
+    def _set_gauge(self, gauge, label, value):
+        if getattr(self, "metrics", None) is not None:
+            getattr(self.metrics, gauge).labels(label).set(value)
+
+    def _span(self, name, **args):
+        """
+        Records a timing span as a trace event while a profiling window is running.
+        """
+        if getattr(self, "profiler", None) is not None:
+            return self.profiler.span(name, **args)
+        return nullcontext()
@@ -1,23 +1,81 @@
+from datetime import datetime, timedelta, timezone
+
 from src.base import BaseModule
-from src.telegram_web import TelegramWebClient, TelegramWebMessageParser, TelegramWebChannelParser
+from src.io import load_json_file, save_json_atomic
+from src.telegram_web import BASE_URL, TelegramWebClient, TelegramWebMessageParser, TelegramWebChannelParser
 
 
 class CrawlerMixin(BaseModule):
 
-    def init_telegram(self, proxy=None):
-        self.telegram_web = TelegramWebClient(proxy=proxy)
+    def init_telegram(self, proxy=None, forwarded_resolution='batch', forwarded_batch_size=20,
+                      channel_ids_file=None, base_url=BASE_URL, transport=None):
+        """
+        forwarded_resolution is either 'batch', where forwarded origins missing from the
+        origin index are fetched in deferred batches, or 'reference', where misses are
+        left unresolved and only the origin channel & message id are kept.
+        """
+        self.telegram_web = TelegramWebClient(proxy=proxy,
+                                              metrics=getattr(self, 'metrics', None),
+                                              base_url=base_url,
+                                              transport=transport,
+                                              logger=getattr(self, 'logger', None))
+        self.forwarded_resolution = forwarded_resolution
+        self.forwarded_batch_size = forwarded_batch_size
+        # (channel user name, message id) -> dict(channel_id, publish_datetime)
+        self.origin_index = dict()
+        self.pending_forwards = []
+        self.init_channel_ids(channel_ids_file)
         self._log('TELEGRAM WEB: INITIATED')
 
-    def get_history(self, publisher, limit=20):
+    def init_channel_ids(self, file_name=None):
+        """
+        Persistent channel user name -> numeric channel id map, filled from the
+        `data-peer` markup of every page we parse and used whenever it is missing.
+        """
+        self.channel_ids_file = file_name
+        self.channel_ids = dict()
+        self.channel_ids_dirty = False
+        try:
+            self.channel_ids = load_json_file(file_name, default=dict())
+        except (OSError, ValueError) as e:
+            self._err(f"TELEGRAM WEB: EXCEPTION {e} OCCURRED WHILE LOADING CHANNEL IDS FROM {file_name}")
+
+    def resolve_channel_id(self, user_name, channel_id=None):
+        if user_name is None:
+            return channel_id
+        key = user_name.lower()
+        if channel_id is None:
+            return self.channel_ids.get(key)
+        if self.channel_ids.get(key) != channel_id:
+            self.channel_ids[key] = channel_id
+            self.channel_ids_dirty = True
+        return channel_id
+
+    def save_channel_ids(self):
+        if not self.channel_ids_file or not self.channel_ids_dirty:
+            return
+        try:
+            save_json_atomic(self.channel_ids_file, self.channel_ids)
+            self.channel_ids_dirty = False
+        except OSError as e:
+            self._err(f"TELEGRAM WEB: EXCEPTION {e} OCCURRED WHILE SAVING CHANNEL IDS TO {self.channel_ids_file}")
+
+    def get_history(self, publisher, limit=20, since=None, until=None, query=None):
+        """
+        With a `query` only the posts matching it are read, from the channel's search pages.
+        """
         user_name = publisher
         messages_list = []
         cursor = None
         publisher_info = None
-        while len(messages_list) < limit:
-            self._log(f"TELEGRAM WEB: GATHERING MESSAGES FROM {user_name} - CURSOR @ {cursor}")
+        while limit is None or len(messages_list) < limit:
+            self._log(f"TELEGRAM WEB: GATHERING MESSAGES FROM {user_name}"
+                      f"{f' MATCHING {query}' if query else ''} - CURSOR @ {cursor}")
             try:
-                channel_content = self.telegram_web.load_channel_feed(user_name, cursor=cursor)
-                channel_parser = TelegramWebChannelParser(content=channel_content)
+                channel_content = self.telegram_web.load_channel_feed(user_name, cursor=cursor, query=query)
+                with self._time('parse_page_seconds'), self._span('parse_page', channel=user_name):
+                    channel_parser = TelegramWebChannelParser(content=channel_content)
+                    message_soups = channel_parser.extract_messages()
             except Exception as e:
                 self._err(f"TELEGRAM WEB: EXCEPTION {e} OCCURRED"
                           f" WHILE GETTING HISTORY OF {user_name}")
@@ -26,27 +84,94 @@ class CrawlerMixin(BaseModule):
             if publisher_info is None:
                 publisher_info = channel_parser.extract_publisher_info()
             # messages
-            for message in channel_parser.extract_messages():
-                message_parser = TelegramWebMessageParser(soup=message)
-                parsed_message = message_parser.parse()
-                parsed_message['channel_id'] = None
+            page = []
+            for message in message_soups:
+                with self._time('parse_message_seconds'), self._span('parse_message'):
+                    message_parser = TelegramWebMessageParser(soup=message)
+                    parsed_message = message_parser.parse()
+                parsed_message['channel_id'] = self.resolve_channel_id(parsed_message['channel'],
+                                                                       message_parser.extract_channel_id())
+                self.index_origin(parsed_message)
+                page.append(parsed_message)
+            for parsed_message in page:
+                # skip posts outside [since, until] before any secondary fetch is made
+                if not self.in_time_window(parsed_message, since=since, until=until):
+                    continue
                 message = self.handle_forwarded_message(
                     self.handle_album_message(parsed_message)
                 )
                 messages_list.append(message)
             cursor = channel_parser.extract_cursor()
+            if cursor is None or self.page_ends_before(page, since):
+                break
 
+        self.resolve_pending_forwards()
+        self.save_channel_ids()
         self._log(f"TELEGRAM WEB: GATHERED {len(messages_list)} MESSAGES FROM {user_name}")
 
         return messages_list, publisher_info
 
+    @staticmethod
+    def in_time_window(message, since=None, until=None):
+        if since is None and until is None:
+            return True
+        publish_datetime = message['publish_datetime']
+        if publish_datetime is None:
+            return False
+        if since is not None and publish_datetime < since:
+            return False
+        if until is not None and publish_datetime > until:
+            return False
+        return True
+
+    @staticmethod
+    def page_ends_before(page, since):
+        """
+        Pages are loaded newest first, so once the oldest post of a page
+        predates `since` no later page can hold posts inside the window.
+        """
+        if since is None:
+            return False
+        dates = [message['publish_datetime'] for message in page if message['publish_datetime'] is not None]
+        return not dates or min(dates) < since
+
+    def get_recent_views(self, publisher, hours=6):
+        """
+        Reads only the feed pages covering the last `hours` hours and returns
+        (channel, id, views, publish_datetime) records; no secondary fetches.
+        """
+        user_name = publisher
+        since = datetime.now(tz=timezone.utc) - timedelta(hours=hours)
+        records = []
+        cursor = None
+        while True:
+            self._log(f"TELEGRAM WEB: REFRESHING VIEWS OF {user_name} - CURSOR @ {cursor}")
+            try:
+                channel_content = self.telegram_web.load_channel_feed(user_name, cursor=cursor)
+                channel_parser = TelegramWebChannelParser(content=channel_content)
+            except Exception as e:
+                self._err(f"TELEGRAM WEB: EXCEPTION {e} OCCURRED"
+                          f" WHILE REFRESHING VIEWS OF {user_name}")
+                break
+            page = [TelegramWebMessageParser(soup=message).extract_views_info()
+                    for message in channel_parser.extract_messages()]
+            records.extend(record for record in page if self.in_time_window(record, since=since))
+            cursor = channel_parser.extract_cursor()
+            if cursor is None or self.page_ends_before(page, since):
+                break
+
+        self._log(f"TELEGRAM WEB: REFRESHED VIEWS OF {len(records)} MESSAGES FROM {user_name}")
+
+        return records
+
     def handle_album_message(self, message):
         try:
             if message['album_info']['is_album']:
                 album_messages = self.telegram_web.load_multiple_posts(message['album_info']['message_links'])
-                message['album_info']['messages'] = list(map(
-                    lambda msg: TelegramWebMessageParser(content=msg).parse(), album_messages
-                ))
+                with self._time('parse_message_seconds'), self._span('parse_album'):
+                    message['album_info']['messages'] = list(map(
+                        lambda msg: TelegramWebMessageParser(content=msg).parse(), album_messages
+                    ))
                 for album_message in message['album_info']['messages']:
                     album_message['channel_id'] = message['channel_id']
         except Exception as e:
@@ -55,18 +180,85 @@ class CrawlerMixin(BaseModule):
             message["album_info"]["messages"] = []
         return message
 
+    @staticmethod
+    def _origin_key(channel, message_id):
+        return (channel or '').lower(), message_id
+
+    def index_origin(self, message, channel_id=None):
+        if message['channel'] is None or message['id'] is None:
+            return
+        self.origin_index[self._origin_key(message['channel'], message['id'])] = dict(
+            channel_id=channel_id if channel_id is not None else message.get('channel_id'),
+            publish_datetime=message['publish_datetime']
+        )
+
+    def lookup_origin(self, channel, message_id):
+        origin = self.origin_index.get(self._origin_key(channel, message_id))
+        if origin is None or origin['channel_id'] is None:
+            return None
+        return origin
+
+    def apply_indexed_origin(self, message):
+        origin = self.lookup_origin(message["forwarded_info"]["channel"],
+                                    message["forwarded_info"]["message_id"])
+        if origin is None:
+            return False
+        message['forwarded_info']['channel_id'] = origin['channel_id']
+        message['forwarded_info']['publish_datetime'] = origin['publish_datetime']
+        return True
+
     def handle_forwarded_message(self, message):
         try:
             if message["forwarded_info"]:
                 message["forwarded_info"]["message"] = dict()
-                if message["forwarded_info"]["link"]:
-                    fwd_msg = self.telegram_web.load_single_post(message["forwarded_info"]["link"])
-                    fwd_msg_parser = TelegramWebMessageParser(content=fwd_msg)
-                    message['forwarded_info']['message'] = fwd_msg_parser.parse()
-                    message['forwarded_info']['channel_id'] = fwd_msg_parser.extract_channel_id()
-                    message['forwarded_info']['publish_datetime'] = \
-                        message['forwarded_info']['message']['publish_datetime']
+                if message["forwarded_info"]["link"] and not self.apply_indexed_origin(message):
+                    message['forwarded_info']['channel_id'] = self.resolve_channel_id(
+                        message['forwarded_info']['channel']
+                    )
+                    if self.forwarded_resolution != 'reference':
+                        self.pending_forwards.append(message)
+                        self._set_gauge('queue_depth', 'pending_forwards', len(self.pending_forwards))
         except Exception as e:
             self._err(f"TELEGRAM WEB: EXCEPTION {e} OCCURRED"
                       f" WHILE GETTING FORWARDED INFO OF MESSAGE {message['id']}")
         return message
+
+    def resolve_pending_forwards(self):
+        """
+        Fetches the forwarded origins which missed the origin index, each distinct
+        origin once, in batches of `forwarded_batch_size` concurrent requests.
+        """
+        pending, self.pending_forwards = self.pending_forwards, []
+        self._set_gauge('queue_depth', 'pending_forwards', 0)
+        # origins crawled on later pages may have entered the index meanwhile
+        pending = [message for message in pending if not self.apply_indexed_origin(message)]
+        links = list(dict.fromkeys(message['forwarded_info']['link'] for message in pending))
+        if links:
+            self._log(f"TELEGRAM WEB: RESOLVING {len(links)} FORWARDED ORIGINS"
+                      f" FOR {len(pending)} MESSAGES")
+
+        resolved = dict()
+        for i in range(0, len(links), self.forwarded_batch_size):
+            batch = links[i:i + self.forwarded_batch_size]
+            for link, content in zip(batch, self.telegram_web.load_multiple_posts(batch, ignore_errors=True)):
+                if not content:
+                    continue
+                try:
+                    with self._time('parse_message_seconds'), self._span('parse_message'):
+                        fwd_msg_parser = TelegramWebMessageParser(content=content)
+                        fwd_msg = fwd_msg_parser.parse()
+                    channel_id = fwd_msg_parser.extract_channel_id()
+                except Exception as e:
+                    self._err(f"TELEGRAM WEB: EXCEPTION {e} OCCURRED WHILE PARSING FORWARDED ORIGIN {link}")
+                    continue
+                channel_id = self.resolve_channel_id(fwd_msg['channel'], channel_id)
+                self.index_origin(fwd_msg, channel_id=channel_id)
+                resolved[link] = (fwd_msg, channel_id)
+
+        for message in pending:
+            if message['forwarded_info']['link'] not in resolved:
+                continue
+            fwd_msg, channel_id = resolved[message['forwarded_info']['link']]
+            message['forwarded_info']['message'] = fwd_msg
+            message['forwarded_info']['channel_id'] = channel_id
+            message['forwarded_info']['publish_datetime'] = fwd_msg['publish_datetime']
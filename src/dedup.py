@@ -0,0 +1,92 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from src.base import BaseModule
+from src.media import MediaStore, CHUNK_SIZE
+
+
+# fetched images are kept in memory up to this size and spooled to a temporary file beyond it
+SPOOL_SIZE = 1024 * 1024
+
+
+class DedupMixin(BaseModule):
+
+    def init_dedup(self, index_dir='phash_index', threshold=10, max_workers=8):
+        # numpy & PIL are only imported once deduplication is enabled
+        from src.phash import PerceptualHashIndex
+        self.phash_index = PerceptualHashIndex(index_dir, threshold=threshold)
+        # images are fetched on the media download pool when there is one
+        self.dedup_pool = getattr(self, 'media_pool', None)
+        self.dedup_pool_owned = self.dedup_pool is None
+        if self.dedup_pool_owned:
+            self.dedup_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='dedup')
+        self._log(f'DEDUP: INDEX OF {self.phash_index.size} IMAGES LOADED FROM {index_dir}')
+
+    def annotate_duplicates(self, values):
+        """
+        Hashes the photo or video thumbnail of every post & album item and sets its
+        `duplicate_cluster_id`; an album takes the cluster of its first clustered item.
+        Images are keyed by their url, so one seen on an earlier crawl reuses its stored
+        hash & cluster. New images are read from the media store when downloaded, otherwise
+        fetched concurrently on the dedup pool.
+        """
+        pending = []
+        hashing = dict()
+        for value in values:
+            for post in list(value.album_messages or []) + [value]:
+                if post.photo_info is not None:
+                    info, path, url = post.photo_info, post.photo_info.local_path, post.photo_info.url
+                elif post.video_info is not None:
+                    info, path, url = post.video_info, post.video_info.thumb_local_path, post.video_info.thumb_url
+                else:
+                    continue
+                if not path and not url:
+                    continue
+                source = MediaStore.source_key(url) if url else os.path.basename(path)
+                indexed = self.phash_index.lookup(source)
+                if indexed is not None:
+                    info.phash = f'{indexed[0]:016x}'
+                    post.duplicate_cluster_id = indexed[1]
+                    continue
+                if source not in hashing:
+                    hashing[source] = self.dedup_pool.submit(self._image_hash, path, url)
+                pending.append((post, info, source, url or path))
+
+        # indexed in post order, so cluster ids do not depend on which fetch finished first
+        for post, info, source, name in pending:
+            try:
+                value = hashing[source].result()
+            except Exception as e:
+                self._err(f'DEDUP: EXCEPTION {e} OCCURRED WHILE HASHING {name}')
+                continue
+            info.phash = f'{value:016x}'
+            post.duplicate_cluster_id = self.phash_index.add(value, source=source)
+
+        for value in values:
+            if value.duplicate_cluster_id is None:
+                value.duplicate_cluster_id = next((message.duplicate_cluster_id
+                                                   for message in value.album_messages or []
+                                                   if message.duplicate_cluster_id is not None), None)
+
+    def _image_hash(self, path=None, url=None):
+        from PIL import Image
+        from src.phash import perceptual_hash
+        if path:
+            with Image.open(path) as image:
+                return perceptual_hash(image)
+        response = self.telegram_web.load_media(url)
+        try:
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+                f.seek(0)
+                with Image.open(f) as image:
+                    return perceptual_hash(image)
+        finally:
+            response.close()
+
+    def close_dedup(self):
+        if self.dedup_pool_owned:
+            self.dedup_pool.shutdown(wait=True)
+        self.phash_index.close()
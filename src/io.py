@@ -1,9 +1,30 @@
+import os
 import json
 
 from src.base import BaseModule
 from src.models import serialize
 
 
+def load_json_file(file_name, default=None):
+    """
+    Returns the JSON content of `file_name`, or `default` when there is no such file.
+    """
+    if not file_name or not os.path.exists(file_name):
+        return default
+    with open(file_name) as f:
+        return json.load(f)
+
+
+def save_json_atomic(file_name, data):
+    """
+    Writes `data` next to `file_name` first, so a crash never leaves a truncated file behind.
+    """
+    tmp_file = f"{file_name}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_file, file_name)
+
+
 class InputInterface(BaseModule):
 
     def init_input(self, *args, **kwargs):
@@ -15,6 +36,9 @@ class InputInterface(BaseModule):
     def round_finished(self):
         raise NotImplementedError()
 
+    def remaining(self):
+        raise NotImplementedError()
+
 
 class OutputInterface(BaseModule):
 
@@ -41,6 +65,9 @@ class FileInputMixin(InputInterface):
     def round_finished(self):
         return self.file_input_index == len(self.file_input_list)
 
+    def remaining(self):
+        return len(self.file_input_list) - self.file_input_index
+
 
 class ConsoleOutputMixin(OutputInterface):
 
@@ -48,7 +75,8 @@ class ConsoleOutputMixin(OutputInterface):
         pass
 
     def save(self, value):
-        serialized = dict()
-        serialize(value, serialized)
-        json_ = json.dumps(serialized)
+        with self._time('serialize_seconds'):
+            serialized = dict()
+            serialize(value, serialized)
+            json_ = json.dumps(serialized)
         self._log(json_)
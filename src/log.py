@@ -1,21 +1,102 @@
+import re
 import sys
+import json
+import time
+import queue
+import atexit
 import logging
+import threading
 from datetime import datetime
-from logging.handlers import RotatingFileHandler
+from functools import lru_cache
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from pytz import timezone
 
 import config
 
 
+@lru_cache(maxsize=None)
+def get_timezone(name):
+    return timezone(name)
+
+
+class TextFormatter(logging.Formatter):
+
+    def format(self, record):
+        formatted = super().format(record)
+        if getattr(record, 'suppressed', None):
+            formatted = f'{formatted} ({record.suppressed} SIMILAR MESSAGES SUPPRESSED)'
+        return formatted
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line.
+    """
+
+    def format(self, record):
+        data = dict(
+            time=self.formatTime(record),
+            logger=record.name,
+            level=record.levelname,
+            thread=record.threadName,
+            message=record.getMessage(),
+        )
+        if getattr(record, 'suppressed', None):
+            data['suppressed'] = record.suppressed
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through at most `burst` records per `window` seconds for each kind of repeated
+    warning/error, where messages differing only in numbers are of the same kind. The
+    number of dropped records is reported on the next record of that kind let through.
+    """
+
+    NORMALIZE = re.compile(r'\d+')
+
+    def __init__(self, burst=5, window=60, level=logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.level = level
+        self.lock = threading.Lock()
+        # key -> [window start, records let through, records dropped]
+        self.counters = dict()
+
+    def filter(self, record):
+        if record.levelno < self.level:
+            return True
+        key = (record.levelno, self.NORMALIZE.sub('#', str(record.msg)))
+        now = time.monotonic()
+        with self.lock:
+            counter = self.counters.get(key)
+            if counter is None or now - counter[0] >= self.window:
+                suppressed = counter[2] if counter else 0
+                self.counters[key] = [now, 1, 0]
+                record.suppressed = suppressed
+                return True
+            if counter[1] < self.burst:
+                counter[1] += 1
+                return True
+            counter[2] += 1
+            return False
+
+
 class ProcessLogger(object):
-    def __init__(self, level=logging.INFO):
+    def __init__(self, level=logging.INFO, json_format=False):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.setLevel(level)
+        self.json_format = json_format
         logging.Formatter.converter = self.custom_time
 
     @property
     def logger_formatter(self):
-        return logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        if self.json_format:
+            return JsonFormatter()
+        return TextFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
     def add_file_handler(self, filename='process.log'):
         file_handler = logging.FileHandler(filename)
@@ -63,22 +144,46 @@ class ProcessLogger(object):
 
         return self
 
+    def add_queue_listener(self, sampling_filter=None):
+        """
+        Moves the handlers added so far behind a queue drained by a background thread,
+        so logging calls on the hot path only enqueue the record.
+        """
+        handlers = self.logger.handlers[:]
+        for handler in handlers:
+            self.logger.removeHandler(handler)
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = QueueHandler(log_queue)
+        if sampling_filter is not None:
+            queue_handler.addFilter(sampling_filter)
+        self.logger.addHandler(queue_handler)
+
+        self.log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        self.log_listener.start()
+        atexit.register(self.log_listener.stop)
+
+        return self
+
     @staticmethod
     def custom_time(*args):
-        tz = timezone(config.TIMEZONE)
-        converted = datetime.now(tz=tz)
+        tz = get_timezone(config.TIMEZONE)
+        # installed as Formatter.converter it is called as a bound method, (formatter, secs)
+        converted = datetime.fromtimestamp(args[-1] if args else time.time(), tz=tz)
         return converted.timetuple()
 
 
 class LoggerMixin(ProcessLogger):
 
-    def init_logger(self):
-        super().__init__()
+    def init_logger(self, json_format=False, sampling_burst=5, sampling_window=60):
+        super().__init__(json_format=json_format)
         if not self.logger.hasHandlers():
             self.add_rotating_file_handler(filename='process.log',
                                            max_bytes=2000000,
                                            backup_count=5
                                            )
             self.add_stdout_handler()
+            self.add_queue_listener(sampling_filter=SamplingFilter(burst=sampling_burst,
+                                                                   window=sampling_window))
 
         self.logger.info('LOGGER: INITIALIZED')
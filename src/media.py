@@ -0,0 +1,176 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import posixpath
+import multiprocessing
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from src.base import BaseModule
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def make_thumbnail(source, target, size):
+    """
+    Runs in the thumbnail process pool, so it has to stay a picklable module level function.
+    """
+    from PIL import Image
+    if os.path.exists(target):
+        return target
+    tmp_target = f'{target}.{os.getpid()}.tmp'
+    try:
+        with Image.open(source) as image:
+            image.thumbnail(size)
+            image.convert('RGB').save(tmp_target, 'JPEG', quality=85)
+        os.replace(tmp_target, target)
+    except BaseException:
+        if os.path.exists(tmp_target):
+            os.remove(tmp_target)
+        raise
+    return target
+
+
+class MediaStore(object):
+    """
+    Content addressed blob store: every file lives at <root>/<sha256[:2]>/<sha256[2:4]>/<sha256><ext>.
+    The url -> blob map is kept in <root>/urls.jsonl, so a url is never downloaded twice.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.tmp_dir = os.path.join(root, 'tmp')
+        self.thumbs_dir = os.path.join(root, 'thumbs')
+        for directory in (self.root, self.tmp_dir, self.thumbs_dir):
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.urls_file = os.path.join(root, 'urls.jsonl')
+        self.urls = dict()
+        if os.path.exists(self.urls_file):
+            with open(self.urls_file) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.urls[entry['url']] = entry['path']
+
+    def lookup(self, url):
+        path = self.urls.get(self.source_key(url))
+        if path is not None and os.path.exists(path):
+            return path
+        return None
+
+    def write(self, url, chunks):
+        """
+        Streams `chunks` into a temporary file while hashing them and moves it to its
+        content address, dropping it when a blob with the same content already exists.
+        """
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+            path = self.blob_path(digest.hexdigest(), posixpath.splitext(urlparse(url).path)[1])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.exists(path):
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._remember(url, path)
+        return path
+
+    def blob_path(self, hex_digest, extension=''):
+        return os.path.join(self.root, hex_digest[:2], hex_digest[2:4], f'{hex_digest}{extension.lower()}')
+
+    def thumbnail_path(self, path):
+        return os.path.join(self.thumbs_dir, f'{os.path.splitext(os.path.basename(path))[0]}.jpg')
+
+    def _remember(self, url, path):
+        key = self.source_key(url)
+        with self.lock:
+            if self.urls.get(key) == path:
+                return
+            self.urls[key] = path
+            with open(self.urls_file, 'a') as f:
+                f.write(json.dumps(dict(url=key, path=path)) + '\n')
+
+    @staticmethod
+    def source_key(url):
+        """
+        Stable key of a media url: cdn urls of the same file differ only by their signed query string.
+        """
+        return url.split('?')[0]
+
+
+class MediaMixin(BaseModule):
+
+    def init_media(self, store_dir='media', max_workers=8, thumbnail_size=(320, 320), thumbnail_workers=2):
+        self.media_store = MediaStore(store_dir)
+        self.media_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='media')
+        # forking would copy the locks held by the download, merger & profiler threads into the workers
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        self.thumbnail_pool = ProcessPoolExecutor(max_workers=thumbnail_workers,
+                                                  mp_context=multiprocessing.get_context(start_method))
+        self.thumbnail_size = thumbnail_size
+        self._log(f'MEDIA: STORE INITIALIZED AT {store_dir}')
+
+    def download_media(self, values):
+        """
+        Downloads the photos, videos & video thumbnails of the transformed posts with at
+        most `max_workers` concurrent downloads, then attaches the local blob paths and
+        the thumbnails generated in the process pool to their PhotoInfo / VideoInfo.
+        """
+        targets = []
+        for value in values:
+            for post in [value] + list(value.album_messages or []):
+                if post.photo_info is not None and post.photo_info.url:
+                    targets.append((post.photo_info, 'url', 'local_path', True))
+                if post.video_info is not None:
+                    if post.video_info.url:
+                        targets.append((post.video_info, 'url', 'local_path', False))
+                    if post.video_info.thumb_url:
+                        targets.append((post.video_info, 'thumb_url', 'thumb_local_path', True))
+
+        futures = [(target, self.media_pool.submit(self._download, getattr(target[0], target[1])))
+                   for target in targets]
+        thumbnails = []
+        for (info, _, path_field, thumbnail), future in futures:
+            path = future.result()
+            if path is None:
+                continue
+            setattr(info, path_field, path)
+            if thumbnail:
+                thumbnails.append((info, self.thumbnail_pool.submit(
+                    make_thumbnail, path, self.media_store.thumbnail_path(path), self.thumbnail_size
+                )))
+
+        for info, future in thumbnails:
+            try:
+                info.thumbnail_path = future.result()
+            except Exception as e:
+                self._err(f'MEDIA: EXCEPTION {e} OCCURRED WHILE GENERATING THUMBNAIL OF {info.url}')
+
+    def _download(self, url):
+        path = self.media_store.lookup(url)
+        if path is not None:
+            return path
+        try:
+            response = self.telegram_web.load_media(url)
+            try:
+                return self.media_store.write(url, response.iter_content(chunk_size=CHUNK_SIZE))
+            finally:
+                response.close()
+        except Exception as e:
+            self._err(f'MEDIA: EXCEPTION {e} OCCURRED WHILE DOWNLOADING {url}')
+            return None
+
+    def close_media(self):
+        self.media_pool.shutdown(wait=True)
+        self.thumbnail_pool.shutdown(wait=True)
@@ -102,6 +102,9 @@ class PhotoInfo:
     width: int = None
     height: int = None
     url: str = None
+    local_path: str = None
+    thumbnail_path: str = None
+    phash: str = None
 
     def format_photo_info(self, obj):
         self.width = obj['photo_info']['width']
@@ -116,6 +119,10 @@ class VideoInfo:
     height: int = None
     url: str = None
     thumb_url: str = None
+    local_path: str = None
+    thumb_local_path: str = None
+    thumbnail_path: str = None
+    phash: str = None
 
     def format_video_info(self, obj):
         document = obj['video_info']
@@ -143,6 +150,7 @@ class PostInfo:
     audio_info: AudioInfo = None
     poll_info: PollInfo = None
     album_messages: list = field(default_factory=list)
+    duplicate_cluster_id: int = None
 
     def format_post_info(self,
                          obj,
@@ -181,3 +189,19 @@ class PostInfo:
 
         if obj['reply_to'] is not None:
             self.reply_to = obj['reply_to']
+
+
+@dataclass(init=True, repr=True)
+class ViewsDelta:
+    channel: str = None
+    message_id: int = None
+    views: int = None
+    delta: int = None
+    publish_datetime: datetime = None
+
+    def format_views_delta(self, obj, previous_views=None):
+        self.channel = obj['channel']
+        self.message_id = obj['id']
+        self.views = obj['views']
+        self.delta = obj['views'] - previous_views if previous_views is not None else obj['views']
+        self.publish_datetime = obj['publish_datetime']
@@ -1,6 +1,87 @@
 from src.base import BaseModule
 
-from prometheus_client import start_http_server
+from prometheus_client import start_http_server, Histogram, Gauge
+
+
+REQUEST_KINDS = ('feed', 'load_more', 'search', 'single_post', 'media')
+LATENCY_BUCKETS = (.05, .1, .25, .5, 1, 2.5, 5, 10)
+STAGE_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def status_class(status_code):
+    """
+    Buckets HTTP statuses so the `status` label stays bounded: 429 is kept apart
+    from the other 4xx responses and failed requests are reported as `error`.
+    """
+    if status_code is None:
+        return 'error'
+    if status_code == 429:
+        return '429'
+    return f'{status_code // 100}xx'
+
+
+class CrawlerMetrics(object):
+    """
+    All crawl stage metrics. prometheus_client registers collectors globally,
+    so a single instance is shared by every process object (see `get_crawler_metrics`).
+    """
+
+    def __init__(self):
+        self.request_seconds = Histogram('telegram_web_request_seconds',
+                                         'Telegram web request latency',
+                                         ['kind', 'status'],
+                                         buckets=LATENCY_BUCKETS)
+        self.response_bytes = Histogram('telegram_web_response_bytes',
+                                        'Telegram web response body size',
+                                        ['kind'],
+                                        buckets=SIZE_BUCKETS)
+        self.requests_in_flight = Gauge('telegram_web_requests_in_flight',
+                                        'Telegram web requests currently in flight',
+                                        ['kind'])
+        self.parse_page_seconds = Histogram('crawler_parse_page_seconds',
+                                            'Time spent parsing a feed page',
+                                            buckets=STAGE_BUCKETS)
+        self.parse_message_seconds = Histogram('crawler_parse_message_seconds',
+                                               'Time spent parsing a single message',
+                                               buckets=STAGE_BUCKETS)
+        self.transform_seconds = Histogram('crawler_transform_seconds',
+                                           'Time spent transforming a post',
+                                           buckets=STAGE_BUCKETS)
+        self.serialize_seconds = Histogram('crawler_serialize_seconds',
+                                           'Time spent serializing a post',
+                                           buckets=STAGE_BUCKETS)
+        self.save_seconds = Histogram('crawler_save_seconds',
+                                      'Time spent saving a post',
+                                      buckets=STAGE_BUCKETS)
+        self.queue_depth = Gauge('crawler_queue_depth',
+                                 'Number of items waiting in a crawler queue',
+                                 ['queue'])
+        self.channel_last_success = Gauge('crawler_channel_last_success_timestamp_seconds',
+                                          'Last time a channel was crawled successfully',
+                                          ['channel'])
+
+    def request_kind(self, kind):
+        return kind if kind in REQUEST_KINDS else 'other'
+
+    def observe_request(self, kind, status_code, elapsed, size=None):
+        kind = self.request_kind(kind)
+        self.request_seconds.labels(kind, status_class(status_code)).observe(elapsed)
+        if size is not None:
+            self.response_bytes.labels(kind).observe(size)
+
+    def track_request(self, kind):
+        return self.requests_in_flight.labels(self.request_kind(kind)).track_inprogress()
+
+
+_crawler_metrics = None
+
+
+def get_crawler_metrics():
+    global _crawler_metrics
+    if _crawler_metrics is None:
+        _crawler_metrics = CrawlerMetrics()
+    return _crawler_metrics
 
 
 class MetricsMixin(BaseModule):
@@ -13,4 +94,4 @@ class MetricsMixin(BaseModule):
             self._log(f'PROMETHEUS: SERVER ALREADY RUNNING ON PORT {port}')
 
     def init_metrics(self):
-        pass
+        self.metrics = get_crawler_metrics()
@@ -0,0 +1,147 @@
+import os
+import hashlib
+import threading
+
+import numpy as np
+from PIL import Image
+
+
+HASH_SIZE = 8
+DCT_SIZE = 32
+
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+DCT_MATRIX = _dct_matrix(DCT_SIZE)
+_POPCOUNT_8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+POPCOUNT_TABLE = _POPCOUNT_8[np.arange(65536) & 0xff] + _POPCOUNT_8[np.arange(65536) >> 8]
+
+
+def perceptual_hash(image):
+    """
+    64 bit pHash: the low frequency 8x8 block of the 2D DCT of a 32x32 grayscale
+    thumbnail, thresholded at its median. Re-encoded or resized copies stay within
+    a few bits of each other.
+    """
+    pixels = np.asarray(image.convert('L').resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS), dtype=np.float64)
+    low_frequencies = (DCT_MATRIX @ pixels @ DCT_MATRIX.T)[:HASH_SIZE, :HASH_SIZE].flatten()
+    bits = low_frequencies > np.median(low_frequencies[1:])
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hamming_distances(hashes, value):
+    xor = np.bitwise_xor(hashes, np.uint64(value))
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(xor)
+    # popcount of each 16 bit quarter, summed column-wise which is cheaper than .sum(axis=1)
+    counts = POPCOUNT_TABLE[xor.view(np.uint16)].reshape(-1, 4)
+    return counts[:, 0] + counts[:, 1] + counts[:, 2] + counts[:, 3]
+
+
+class PerceptualHashIndex(object):
+    """
+    Append only on-disk index of image hashes, their near-duplicate cluster ids and a
+    digest of the image source, stored as raw uint64 / int32 / uint64 arrays (20 bytes per
+    image) and scanned in memory with numpy. Images seen again on later crawls are found by
+    their source digest and neither hashed nor appended twice.
+    """
+
+    def __init__(self, directory, threshold=10):
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        hashes_file = os.path.join(directory, 'hashes.u64')
+        clusters_file = os.path.join(directory, 'clusters.i32')
+        sources_file = os.path.join(directory, 'sources.u64')
+        hashes = np.empty(0, np.uint64)
+        clusters = np.empty(0, np.int32)
+        if os.path.exists(hashes_file) and os.path.exists(clusters_file):
+            hashes = np.fromfile(hashes_file, dtype=np.uint64)
+            clusters = np.fromfile(clusters_file, dtype=np.int32)
+        # a crash between the appends leaves some files one entry ahead
+        self.size = min(len(hashes), len(clusters))
+        if os.path.exists(sources_file):
+            sources = np.fromfile(sources_file, dtype=np.uint64)
+            self.size = min(self.size, len(sources))
+        else:
+            # indexes written before sources were tracked have no digests, 0 never matches one
+            sources = np.zeros(self.size, dtype=np.uint64)
+            sources.tofile(sources_file)
+        capacity = max(1024, 2 * self.size)
+        self.hashes = np.zeros(capacity, dtype=np.uint64)
+        self.clusters = np.zeros(capacity, dtype=np.int32)
+        self.sources = np.zeros(capacity, dtype=np.uint64)
+        self.hashes[:self.size] = hashes[:self.size]
+        self.clusters[:self.size] = clusters[:self.size]
+        self.sources[:self.size] = sources[:self.size]
+        self.next_cluster = int(self.clusters[:self.size].max()) + 1 if self.size else 0
+        self.hashes_file = open(hashes_file, 'ab')
+        self.clusters_file = open(clusters_file, 'ab')
+        self.sources_file = open(sources_file, 'ab')
+        self.hashes_file.truncate(self.size * 8)
+        self.clusters_file.truncate(self.size * 4)
+        self.sources_file.truncate(self.size * 8)
+
+    @staticmethod
+    def source_digest(source):
+        return int.from_bytes(hashlib.sha256(source.encode()).digest()[:8], 'big') or 1
+
+    def lookup(self, source):
+        """
+        Returns (hash, cluster id) of an already indexed source, or None.
+        """
+        positions = np.flatnonzero(self.sources[:self.size] == np.uint64(self.source_digest(source)))
+        if len(positions) == 0:
+            return None
+        return int(self.hashes[positions[0]]), int(self.clusters[positions[0]])
+
+    def nearest(self, value):
+        """
+        Returns (cluster id, distance) of the closest indexed hash, or (None, None).
+        """
+        if self.size == 0:
+            return None, None
+        distances = hamming_distances(self.hashes[:self.size], value)
+        position = int(np.argmin(distances))
+        return int(self.clusters[position]), int(distances[position])
+
+    def add(self, value, source=None):
+        """
+        Indexes a hash and returns its cluster id: the cluster of the nearest hash within
+        `threshold` bits, or a new cluster. A source indexed before keeps its cluster.
+        """
+        with self.lock:
+            if source is not None:
+                indexed = self.lookup(source)
+                if indexed is not None:
+                    return indexed[1]
+            cluster, distance = self.nearest(value)
+            if cluster is None or distance > self.threshold:
+                cluster = self.next_cluster
+                self.next_cluster += 1
+            if self.size == len(self.hashes):
+                self.hashes = np.concatenate([self.hashes, np.zeros_like(self.hashes)])
+                self.clusters = np.concatenate([self.clusters, np.zeros_like(self.clusters)])
+                self.sources = np.concatenate([self.sources, np.zeros_like(self.sources)])
+            digest = self.source_digest(source) if source is not None else 0
+            self.hashes[self.size] = value
+            self.clusters[self.size] = cluster
+            self.sources[self.size] = digest
+            self.size += 1
+            self.hashes_file.write(np.uint64(value).tobytes())
+            self.clusters_file.write(np.int32(cluster).tobytes())
+            self.sources_file.write(np.uint64(digest).tobytes())
+            self.hashes_file.flush()
+            self.clusters_file.flush()
+            self.sources_file.flush()
+            return cluster
+
+    def close(self):
+        self.hashes_file.close()
+        self.clusters_file.close()
+        self.sources_file.close()
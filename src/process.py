@@ -0,0 +1,216 @@
+import time
+
+from prometheus_client import Counter
+
+import config
+from src.log import LoggerMixin
+from src.monitoring import MetricsMixin
+from src.profiling import ProfilingMixin
+from src.crawl import CrawlerMixin
+from src.transform import TransformerMixin
+from src.io import FileInputMixin, ConsoleOutputMixin, load_json_file, save_json_atomic
+from src.transport import make_transport
+from src.media import MediaMixin
+from src.dedup import DedupMixin
+from src.search_index import SearchIndexMixin
+
+
+class CrawlerProcess(LoggerMixin,
+                     MetricsMixin,
+                     ProfilingMixin,
+                     CrawlerMixin,
+                     TransformerMixin,
+                     MediaMixin,
+                     DedupMixin,
+                     SearchIndexMixin,
+                     FileInputMixin,
+                     ConsoleOutputMixin):
+
+    def __init__(self, file_name, mode='crawl', since=None, until=None, queries=None):
+        self.mode = mode
+        self.since = since
+        self.until = until
+        self.queries = queries if queries is not None else config.SEARCH_QUERIES
+        self.init_logger(json_format=config.LOG_FORMAT == 'json',
+                         sampling_burst=config.LOG_SAMPLING_BURST,
+                         sampling_window=config.LOG_SAMPLING_WINDOW)
+        self.init_metrics_server()
+        self.init_metrics()
+        self.init_profiling(port=config.PROFILING_PORT,
+                            host=config.PROFILING_HOST,
+                            output_dir=config.PROFILING_OUTPUT_DIR,
+                            window=config.PROFILING_WINDOW_SECONDS)
+        self.init_input(input_file=file_name)
+        if mode == 'refresh':
+            self.init_views_cache(file_name=config.VIEWS_CACHE_FILE)
+        self.init_output()
+
+        proxy_config = {
+            'proxy_type': config.PROXY_TYPE,
+            'addr': config.PROXY_ADDRESS,
+            'port': config.PROXY_PORT,
+        }
+
+        proxy = None
+        if config.USE_PROXY:
+            # socks proxies resolve host names remotely (socks5h), http(s) proxies always do
+            scheme = proxy_config['proxy_type']
+            if scheme.startswith('socks') and not scheme.endswith('h'):
+                scheme = f'{scheme}h'
+            proxy = f"{scheme}://{proxy_config['addr']}:{proxy_config['port']}"
+
+        self.init_telegram(proxy=proxy,
+                           forwarded_resolution=config.FORWARDED_RESOLUTION,
+                           forwarded_batch_size=config.FORWARDED_BATCH_SIZE,
+                           channel_ids_file=config.CHANNEL_IDS_FILE,
+                           base_url=config.TELEGRAM_BASE_URL,
+                           transport=make_transport(mode=config.HTTP_TRANSPORT,
+                                                    cassette=config.CASSETTE_FILE,
+                                                    realtime=config.REPLAY_REALTIME))
+
+        if config.DOWNLOAD_MEDIA:
+            self.init_media(store_dir=config.MEDIA_STORE_DIR,
+                            max_workers=config.MEDIA_MAX_WORKERS,
+                            thumbnail_size=config.MEDIA_THUMBNAIL_SIZE)
+        if config.DEDUP_IMAGES:
+            self.init_dedup(index_dir=config.PHASH_INDEX_DIR,
+                            threshold=config.PHASH_THRESHOLD)
+        if config.INDEX_POSTS:
+            self.init_search_index(index_dir=config.SEARCH_INDEX_DIR,
+                                   flush_postings=config.SEARCH_INDEX_FLUSH_POSTINGS,
+                                   flush_interval=config.SEARCH_INDEX_FLUSH_INTERVAL,
+                                   merge_factor=config.SEARCH_INDEX_MERGE_FACTOR)
+
+        self.logger.info('PROCESS: INITIALIZED')
+
+    def init_views_cache(self, file_name=None):
+        """
+        Persistent "channel/message id" -> [views, publish timestamp] map of the last views
+        seen by refresh, so that deltas carry over between refresh runs.
+        """
+        self.views_cache_file = file_name
+        self.views_cache = dict()
+        try:
+            self.views_cache = load_json_file(file_name, default=dict())
+        except (OSError, ValueError) as e:
+            self._err(f'PROCESS: EXCEPTION {e} OCCURRED WHILE LOADING VIEWS CACHE FROM {file_name}')
+
+    def save_views_cache(self):
+        if not self.views_cache_file:
+            return
+        # posts older than twice the refresh window are never read again
+        oldest = time.time() - 2 * config.REFRESH_WINDOW_HOURS * 3600
+        self.views_cache = {key: value for key, value in self.views_cache.items()
+                            if value[1] is None or value[1] >= oldest}
+        try:
+            save_json_atomic(self.views_cache_file, self.views_cache)
+        except OSError as e:
+            self._err(f'PROCESS: EXCEPTION {e} OCCURRED WHILE SAVING VIEWS CACHE TO {self.views_cache_file}')
+
+    def init_metrics(self):
+        super().init_metrics()
+        self.crawler_counter = Counter(f'cralwed_post',
+                                       'Telegram crawler fetched post counter')
+
+    def run(self):
+        while True:
+            try:
+                if self.round_finished():
+                    break
+                next_ = self.next()
+                self._set_gauge('queue_depth', 'input', self.remaining())
+                if self.mode == 'refresh':
+                    self.refresh(next_)
+                elif self.mode == 'search':
+                    self.search(next_)
+                else:
+                    self.process(next_)
+            except KeyboardInterrupt:
+                self.logger.warning('PROCESS: KEYBOARD INTERRUPT')
+            finally:
+                pass
+        self.telegram_web.transport.close()
+        if config.DOWNLOAD_MEDIA:
+            self.close_media()
+        if config.DEDUP_IMAGES:
+            self.close_dedup()
+        if config.INDEX_POSTS:
+            self.close_search_index()
+
+    def process(self, channel):
+        self.logger.info(f'PROCESSING {channel}')
+
+        with self._span('get_history', channel=channel):
+            items, publisher_info = self.get_history(channel,
+                                                     limit=config.MAX_POSTS_PER_CHANNEL or None,
+                                                     since=self.since,
+                                                     until=self.until)
+        self.handle_items(channel, items, publisher_info)
+
+    def search(self, channel):
+        """
+        Crawls only the posts of `channel` matching one of the search queries; a post
+        matching several queries is kept once.
+        """
+        self.logger.info(f'SEARCHING {channel} FOR {", ".join(self.queries)}')
+
+        items = []
+        publisher_info = None
+        seen = set()
+        for query in self.queries:
+            with self._span('get_history', channel=channel, query=query):
+                found, found_publisher_info = self.get_history(channel,
+                                                               limit=config.MAX_POSTS_PER_CHANNEL or None,
+                                                               since=self.since,
+                                                               until=self.until,
+                                                               query=query)
+            publisher_info = publisher_info or found_publisher_info
+            for item in found:
+                key = (item['channel'], item['id'])
+                if key not in seen:
+                    seen.add(key)
+                    items.append(item)
+        self.handle_items(channel, items, publisher_info)
+
+    def handle_items(self, channel, items, publisher_info):
+        self.crawler_counter.inc(len(items))
+        if publisher_info is not None:
+            self.metrics.channel_last_success.labels(channel).set_to_current_time()
+        values = []
+        for item in items:
+            if item['type'] == 'album':
+                if len(item['album_info']['messages']) > 0:
+                    with self._time('transform_seconds'), self._span('transform'):
+                        values.append(self.transform(item['album_info']['messages'],
+                                                     publisher=publisher_info))
+            else:
+                with self._time('transform_seconds'), self._span('transform'):
+                    values.append(self.transform([item], publisher=publisher_info))
+        if config.DOWNLOAD_MEDIA:
+            with self._span('download_media', channel=channel):
+                self.download_media(values)
+        if config.DEDUP_IMAGES:
+            with self._span('annotate_duplicates', channel=channel):
+                self.annotate_duplicates(values)
+        for value in values:
+            with self._time('save_seconds'), self._span('save'):
+                self.save(value)
+
+    def refresh(self, channel):
+        self.logger.info(f'REFRESHING {channel}')
+
+        with self._span('get_recent_views', channel=channel):
+            records = self.get_recent_views(channel, hours=config.REFRESH_WINDOW_HOURS)
+        if records:
+            self.metrics.channel_last_success.labels(channel).set_to_current_time()
+        for record in records:
+            key = f"{record['channel']}/{record['id']}"
+            previous_views = self.views_cache.get(key, [None])[0]
+            if previous_views == record['views']:
+                continue
+            publish_datetime = record['publish_datetime']
+            self.views_cache[key] = [record['views'],
+                                     publish_datetime.timestamp() if publish_datetime is not None else None]
+            with self._time('save_seconds'), self._span('save'):
+                self.save(self.transform_views(record, previous_views=previous_views))
+        self.save_views_cache()
@@ -0,0 +1,164 @@
+import os
+import sys
+import json
+import time
+import signal
+import threading
+import tracemalloc
+from datetime import datetime
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from src.base import BaseModule
+
+
+# upper bound of a window, so a single request cannot keep tracemalloc & the sampler running
+PROFILE_MAX_SECONDS = 300
+
+
+class Profiler(object):
+    """
+    Runs a fixed profiling window on demand: a sampling CPU profiler (collapsed stacks,
+    loadable by flamegraph.pl / speedscope), a tracemalloc snapshot and the timing spans
+    recorded meanwhile as Chrome trace events (loadable by Perfetto / chrome://tracing).
+    """
+
+    def __init__(self, output_dir='profiles', window=30, sample_interval=0.005, log=print):
+        self.output_dir = output_dir
+        self.window = window
+        self.sample_interval = sample_interval
+        self.log = log
+        self.lock = threading.Lock()
+        self.running = False
+        self.samples = Counter()
+        self.trace_events = []
+        self.started_at = None
+
+    @contextmanager
+    def span(self, name, **args):
+        if not self.running:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.trace_events.append(dict(
+                name=name,
+                ph='X',
+                ts=int(start * 1e6),
+                dur=int((end - start) * 1e6),
+                pid=os.getpid(),
+                tid=threading.get_ident(),
+                args=args
+            ))
+
+    def start(self, seconds=None):
+        with self.lock:
+            if self.running:
+                return False
+            self.running = True
+        self.samples = Counter()
+        self.trace_events = []
+        # a signal & an http window may start within the same second, worker processes may share output_dir
+        self.started_at = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')[:-3]}-{os.getpid()}"
+        seconds = min(seconds if seconds and seconds > 0 else self.window, PROFILE_MAX_SECONDS)
+        tracemalloc.start()
+        threading.Thread(target=self._sample, args=(time.monotonic() + seconds,),
+                         name='profiler-sampler', daemon=True).start()
+        self.log(f'PROFILER: STARTED FOR {seconds} SECONDS')
+        return True
+
+    def _sample(self, deadline):
+        own_thread = threading.get_ident()
+        thread_names = dict()
+        while time.monotonic() < deadline:
+            for thread in threading.enumerate():
+                thread_names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                self.samples[';'.join(reversed(stack))] += 1
+            time.sleep(self.sample_interval)
+        self._stop()
+
+    def _stop(self):
+        samples, trace_events = self.samples, self.trace_events
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        self.running = False
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(self.output_dir, self.started_at)
+        with open(f'{prefix}-cpu.folded', 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f'{stack} {count}\n')
+        snapshot.dump(f'{prefix}-memory.snapshot')
+        with open(f'{prefix}-memory.txt', 'w') as f:
+            for stat in snapshot.statistics('lineno')[:50]:
+                f.write(f'{stat}\n')
+        with open(f'{prefix}-trace.json', 'w') as f:
+            json.dump(dict(traceEvents=trace_events, displayTimeUnit='ms'), f)
+        self.log(f'PROFILER: RESULTS WRITTEN TO {prefix}-*')
+
+
+class ProfilingRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/profile':
+            self.send_error(404)
+            return
+        try:
+            seconds = float(parse_qs(url.query).get('seconds', [0])[0]) or None
+        except ValueError:
+            self.send_error(400, 'seconds must be a number')
+            return
+        started = self.server.profiler.start(seconds)
+        body = json.dumps(dict(started=started, running=self.server.profiler.running)).encode()
+        self.send_response(202 if started else 409)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ProfilingMixin(BaseModule):
+
+    def init_profiling(self,
+                       port=9101,
+                       host='127.0.0.1',
+                       output_dir='profiles',
+                       window=30,
+                       signum=getattr(signal, 'SIGUSR1', None)):
+        self.profiler = Profiler(output_dir=output_dir, window=window, log=self._log)
+
+        if signum is not None:
+            try:
+                signal.signal(signum, lambda *args: self.profiler.start())
+                self._log(f'PROFILER: SIGNAL {signum} HANDLER INSTALLED')
+            except ValueError:
+                # signal handlers can only be installed from the main thread
+                self._log('PROFILER: SIGNAL HANDLER NOT INSTALLED')
+
+        if port:
+            try:
+                # the endpoint has no authentication, keep it off public interfaces by default
+                server = ThreadingHTTPServer((host, port), ProfilingRequestHandler)
+                server.profiler = self.profiler
+                threading.Thread(target=server.serve_forever, name='profiler-http', daemon=True).start()
+                self._log(f'PROFILER: SERVER INITIALIZED ON {host}:{port}')
+            except OSError:
+                self._log(f'PROFILER: SERVER ALREADY RUNNING ON PORT {port}')
@@ -0,0 +1,409 @@
+import os
+import re
+import glob
+import json
+import time
+import zlib
+import struct
+import threading
+import unicodedata
+from datetime import datetime, timezone
+from collections import defaultdict
+
+from src.base import BaseModule
+from src.models import PostInfo
+
+
+SEGMENT_MAGIC = b'TGIX1'
+PARTITION_SECONDS = 3600
+# (partition seconds, age) from finest to coarsest: posts older than the age of a tier are
+# written to, and their finer partitions folded into, partitions of that tier
+PARTITION_TIERS = ((PARTITION_SECONDS, 0), (86400, 86400), (30 * 86400, 30 * 86400))
+# adding blocks while this many times `flush_postings` are waiting for the background thread
+MAX_BUFFERED_FLUSHES = 4
+TOKEN_PATTERN = re.compile(r'\w{2,}')
+# persian text mixes arabic & persian code points for the same letters
+CHARACTER_MAP = str.maketrans({'ي': 'ی', 'ى': 'ی', 'ك': 'ک', 'ة': 'ه', '‌': ' '})
+
+
+def normalize_token(token):
+    return unicodedata.normalize('NFKC', token).casefold().translate(CHARACTER_MAP)
+
+
+def post_terms(text, hashtags):
+    """
+    Index terms of a post: `#tag` for each hashtag and its normalised text tokens.
+    """
+    terms = {f'#{normalize_token(hashtag)}' for hashtag in hashtags or []}
+    if text:
+        terms.update(TOKEN_PATTERN.findall(normalize_token(text)))
+    return terms
+
+
+class Segment(object):
+    """
+    Immutable file of the postings of one time partition. Layout: magic, header length,
+    zlib compressed JSON header (channel table and term -> [offset, length, count]) and
+    one zlib compressed block per term with its channel, message id & delta coded
+    timestamp columns. The header is read on first use and queries only read the blocks
+    of their terms.
+    """
+
+    def __init__(self, path, header=None, data_offset=None):
+        self.path = path
+        self._header = header
+        self.data_offset = data_offset
+
+    @property
+    def header(self):
+        if self._header is None:
+            with open(self.path, 'rb') as f:
+                if f.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+                    raise ValueError(f'{self.path} is not an index segment')
+                header_length, = struct.unpack('>Q', f.read(8))
+                header = json.loads(zlib.decompress(f.read(header_length)))
+            self.data_offset = len(SEGMENT_MAGIC) + 8 + header_length
+            self._header = header
+        return self._header
+
+    @property
+    def terms(self):
+        return self.header['terms']
+
+    @property
+    def min_ts(self):
+        return self.header['min_ts']
+
+    @property
+    def max_ts(self):
+        return self.header['max_ts']
+
+    def postings(self, term):
+        entry = self.terms.get(term)
+        if entry is None:
+            return []
+        offset, length, _ = entry
+        with open(self.path, 'rb') as f:
+            f.seek(self.data_offset + offset)
+            return self._decode(f.read(length))
+
+    def all_postings(self):
+        # merges read every block, so the file is read once rather than once per term
+        terms = self.terms
+        with open(self.path, 'rb') as f:
+            f.seek(self.data_offset)
+            data = f.read()
+        return {term: self._decode(data[offset:offset + length]) for term, (offset, length, _) in terms.items()}
+
+    def _decode(self, block):
+        channels, message_ids, ts_deltas = json.loads(zlib.decompress(block))
+        names = self.header['channels']
+        postings = []
+        ts = 0
+        for channel, message_id, ts_delta in zip(channels, message_ids, ts_deltas):
+            ts += ts_delta
+            postings.append((names[channel], message_id, ts))
+        return postings
+
+    @staticmethod
+    def write(path, postings_by_term):
+        """
+        Writes a segment of the given postings. A post indexed more than once under a term
+        keeps a single posting, the one with the latest timestamp.
+        """
+        channels = sorted({posting[0] for postings in postings_by_term.values() for posting in postings})
+        channel_index = {channel: i for i, channel in enumerate(channels)}
+        terms = dict()
+        blocks = []
+        offset = 0
+        min_ts, max_ts = None, None
+        for term in sorted(postings_by_term):
+            latest = dict()
+            for channel, message_id, ts in postings_by_term[term]:
+                if latest.get((channel, message_id), ts) <= ts:
+                    latest[(channel, message_id)] = ts
+            postings = sorted(((channel, message_id, ts) for (channel, message_id), ts in latest.items()),
+                              key=lambda posting: posting[2])
+            ts_deltas, previous = [], 0
+            for _, _, ts in postings:
+                ts_deltas.append(ts - previous)
+                previous = ts
+            block = zlib.compress(json.dumps([
+                [channel_index[posting[0]] for posting in postings],
+                [posting[1] for posting in postings],
+                ts_deltas
+            ], separators=(',', ':')).encode())
+            terms[term] = [offset, len(block), len(postings)]
+            blocks.append(block)
+            offset += len(block)
+            min_ts = postings[0][2] if min_ts is None else min(min_ts, postings[0][2])
+            max_ts = postings[-1][2] if max_ts is None else max(max_ts, postings[-1][2])
+
+        header = dict(channels=channels, terms=terms, min_ts=min_ts, max_ts=max_ts)
+        compressed = zlib.compress(json.dumps(header, ensure_ascii=False).encode())
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(SEGMENT_MAGIC)
+            f.write(struct.pack('>Q', len(compressed)))
+            f.write(compressed)
+            for block in blocks:
+                f.write(block)
+        os.replace(tmp_path, path)
+        return Segment(path, header=header, data_offset=len(SEGMENT_MAGIC) + 8 + len(compressed))
+
+
+def partition_of(ts, now):
+    """
+    Partition of a publish timestamp as (seconds, number), in the coarsest tier its age allows.
+    """
+    seconds = max(seconds for seconds, age in PARTITION_TIERS if ts < now - age or age == 0)
+    return seconds, ts // seconds
+
+
+def partition_directory(partition):
+    # hourly partitions keep the plain directory names of indexes written before the tiers
+    seconds, number = partition
+    return str(number) if seconds == PARTITION_SECONDS else f'{seconds}s-{number}'
+
+
+def parse_partition_directory(name):
+    if 's-' in name:
+        seconds, number = name.split('s-')
+        return int(seconds), int(number)
+    return PARTITION_SECONDS, int(name)
+
+
+class InvertedIndex(object):
+    """
+    Incremental inverted index of hashtags & text tokens to (channel, message id, publish
+    timestamp) postings. New postings are buffered in memory; a background thread flushes
+    them into one segment per partition (an hour, a day for posts older than a day and 30
+    days for posts older than that), folds partitions into the coarser tier they age into
+    and merges the segments of a partition once it holds more than `merge_factor` of them.
+    """
+
+    def __init__(self, directory, flush_postings=50000, flush_interval=60, merge_factor=4, merge_interval=30):
+        self.directory = directory
+        self.flush_postings = flush_postings
+        self.flush_interval = flush_interval
+        self.merge_factor = merge_factor
+        self.merge_interval = merge_interval
+        self.lock = threading.RLock()
+        self.flushed = threading.Condition(self.lock)
+        # partition -> term -> postings
+        self.buffer = defaultdict(lambda: defaultdict(list))
+        self.buffered = 0
+        # the buffer being written to segments, still visible to queries until they are
+        self.flushing = dict()
+        self.last_flush = time.monotonic()
+        self.last_merge = time.monotonic()
+        # partition -> segments, oldest first
+        self.segments = defaultdict(list)
+        # segments replaced by a merge are removed once no query is reading them
+        self.readers = 0
+        self.retired = []
+        os.makedirs(directory, exist_ok=True)
+        for path in sorted(glob.glob(os.path.join(directory, '*', 'seg-*.seg'))):
+            partition = parse_partition_directory(os.path.basename(os.path.dirname(path)))
+            self.segments[partition].append(Segment(path))
+        self.sequence = max((int(os.path.basename(segment.path)[4:-4])
+                             for segments in self.segments.values() for segment in segments), default=0)
+
+        self.closed = threading.Event()
+        self.wakeup = threading.Event()
+        self.merger = threading.Thread(target=self._background_loop, name='index-merger', daemon=True)
+        self.merger.start()
+
+    def add(self, channel, message_id, publish_ts, terms):
+        partition = partition_of(publish_ts, time.time())
+        with self.lock:
+            while self.buffered >= MAX_BUFFERED_FLUSHES * self.flush_postings and self.merger.is_alive():
+                self.wakeup.set()
+                self.flushed.wait(self.flush_interval)
+            for term in terms:
+                self.buffer[partition][term].append((channel, message_id, publish_ts))
+            self.buffered += len(terms)
+            if self.buffered >= self.flush_postings:
+                self.wakeup.set()
+
+    def flush(self):
+        # only called from the background thread, or by close once it has stopped
+        with self.lock:
+            self.flushing, self.buffer = self.buffer, defaultdict(lambda: defaultdict(list))
+            self.buffered = 0
+            self.last_flush = time.monotonic()
+            self.flushed.notify_all()
+        for partition, postings_by_term in self.flushing.items():
+            segment = Segment.write(self._segment_path(partition), postings_by_term)
+            with self.lock:
+                self.segments[partition].append(segment)
+        with self.lock:
+            self.flushing = dict()
+
+    def merge(self, partitions, target):
+        """
+        Merges the segments of `partitions` into one segment of the `target` partition.
+        """
+        with self.lock:
+            segments = [segment for partition in partitions for segment in self.segments.get(partition, [])]
+        if partitions == [target]:
+            # the oldest, largest segments are only rewritten once the newer ones add up to a
+            # `merge_factor`th of their size, so each posting is rewritten a logarithmic number of times
+            sizes = [os.path.getsize(segment.path) for segment in segments]
+            while len(segments) > 1 and sizes[0] > self.merge_factor * sum(sizes[1:]):
+                segments, sizes = segments[1:], sizes[1:]
+            if len(segments) < 2:
+                return
+        if not segments:
+            return
+        postings_by_term = defaultdict(list)
+        for segment in segments:
+            for term, postings in segment.all_postings().items():
+                postings_by_term[term].extend(postings)
+        merged = Segment.write(self._segment_path(target), postings_by_term)
+        replaced = set(segments)
+        with self.lock:
+            # the merged segment takes the place of the ones it replaces, segments stay oldest first
+            position = next((i for i, segment in enumerate(self.segments[target]) if segment in replaced), 0)
+            for partition in partitions:
+                remaining = [segment for segment in self.segments.pop(partition, []) if segment not in replaced]
+                if remaining:
+                    self.segments[partition] = remaining
+            self.segments[target].insert(position, merged)
+            self.retired.extend(segments)
+        self._remove_retired()
+
+    def merge_partitions(self):
+        now = int(time.time())
+        with self.lock:
+            folds = defaultdict(list)
+            for seconds, number in self.segments:
+                # a partition is folded once its last second belongs to a coarser tier
+                target = partition_of((number + 1) * seconds - 1, now)
+                if target[0] > seconds:
+                    folds[target].append((seconds, number))
+            partitions = [partition for partition, segments in self.segments.items()
+                          if len(segments) > self.merge_factor and partition not in folds]
+        merges = [(sources + [target], target) for target, sources in folds.items()]
+        merges += [([partition], partition) for partition in partitions]
+        for sources, target in merges:
+            # adding waits on a full buffer, so flushing goes before the rest of the merges
+            if self.buffered >= self.flush_postings:
+                self.flush()
+            self.merge(sources, target)
+
+    def _background_loop(self):
+        while not self.closed.is_set():
+            self.wakeup.wait(min(self.flush_interval, self.merge_interval))
+            self.wakeup.clear()
+            if self.closed.is_set():
+                break
+            now = time.monotonic()
+            due = now - self.last_flush >= self.flush_interval
+            if self.buffered >= self.flush_postings or (self.buffered and due):
+                self.flush()
+            if now - self.last_merge >= self.merge_interval:
+                self.last_merge = now
+                self.merge_partitions()
+
+    def _remove_retired(self):
+        with self.lock:
+            if self.readers:
+                return
+            retired, self.retired = self.retired, []
+        for segment in retired:
+            os.remove(segment.path)
+            # folded partitions leave their directory empty, rmdir fails on any other
+            try:
+                os.rmdir(os.path.dirname(segment.path))
+            except OSError:
+                pass
+
+    def _segment_path(self, partition):
+        with self.lock:
+            self.sequence += 1
+            sequence = self.sequence
+        directory = os.path.join(self.directory, partition_directory(partition))
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f'seg-{sequence:08d}.seg')
+
+    def query(self, term, since=None, until=None, limit=None):
+        """
+        Postings of a term (`#hashtag` or a text token) published within [since, until],
+        newest first, as (channel, message id, publish datetime) tuples.
+        """
+        term = normalize_token(term)
+        since_ts = int(since.timestamp()) if since is not None else None
+        until_ts = int(until.timestamp()) if until is not None else None
+
+        def overlaps(partition):
+            seconds, number = partition
+            after_since = since_ts is None or (number + 1) * seconds > since_ts
+            return after_since and (until_ts is None or number * seconds <= until_ts)
+
+        # segments are read outside the lock, so adding & flushing are not held up by queries
+        with self.lock:
+            segments = [segment for partition, segments in self.segments.items() if overlaps(partition)
+                        for segment in segments]
+            postings = [posting for buffer in (self.buffer, self.flushing)
+                        for partition, postings_by_term in buffer.items() if overlaps(partition)
+                        for posting in postings_by_term.get(term, [])]
+            self.readers += 1
+        try:
+            for segment in segments:
+                postings.extend(segment.postings(term))
+        finally:
+            with self.lock:
+                self.readers -= 1
+            self._remove_retired()
+
+        latest = dict()
+        for channel, message_id, ts in postings:
+            if (since_ts is None or ts >= since_ts) and (until_ts is None or ts <= until_ts):
+                if latest.get((channel, message_id), ts) <= ts:
+                    latest[(channel, message_id)] = ts
+        postings = sorted(latest.items(), key=lambda posting: posting[1], reverse=True)[:limit]
+        return [(channel, message_id, datetime.fromtimestamp(ts, tz=timezone.utc))
+                for (channel, message_id), ts in postings]
+
+    def query_channels(self, term, since=None, until=None):
+        """
+        Number of posts per channel matching a term within [since, until].
+        """
+        counts = defaultdict(int)
+        for channel, _, _ in self.query(term, since=since, until=until):
+            counts[channel] += 1
+        return dict(counts)
+
+    def close(self):
+        self.closed.set()
+        self.wakeup.set()
+        self.merger.join()
+        self.flush()
+
+
+class SearchIndexMixin(BaseModule):
+
+    def init_search_index(self, index_dir='search_index', flush_postings=50000, flush_interval=60, merge_factor=4):
+        self.search_index = InvertedIndex(index_dir,
+                                          flush_postings=flush_postings,
+                                          flush_interval=flush_interval,
+                                          merge_factor=merge_factor)
+        self._log(f'SEARCH INDEX: INITIALIZED AT {index_dir}')
+
+    def save(self, value):
+        if getattr(self, 'search_index', None) is not None and isinstance(value, PostInfo):
+            self.index_post(value)
+        super().save(value)
+
+    def index_post(self, value):
+        if value.publish_datetime is None or value.publisher_info is None:
+            return
+        channel = value.publisher_info.username or value.publisher_info.link.rsplit('/', 1)[-1]
+        self.search_index.add(channel.lower(),
+                              value.message_id,
+                              int(value.publish_datetime.timestamp()),
+                              post_terms(value.text, value.hashtags))
+
+    def close_search_index(self):
+        self.search_index.close()
@@ -1,15 +1,21 @@
 import re
 import json
+import time
+import logging
 import requests
 import datetime
 import calendar
 from bs4 import BeautifulSoup
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urlencode
+from contextlib import nullcontext
 from concurrent.futures import ThreadPoolExecutor
 
+from src.transport import HttpTransport
+
 
 USER_AGENT = "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:94.0) Gecko/20100101 Firefox/94.0"
 REQUEST_TIMEOUT = 5
+BASE_URL = "https://t.me"
 
 
 class TelegramWebBaseException(Exception):
@@ -19,34 +25,43 @@ class TelegramWebBaseException(Exception):
 
 
 class TelegramWebClient:
-    def __init__(self, proxy=None):
+    def __init__(self, proxy=None, metrics=None, base_url=BASE_URL, transport=None, logger=None):
+        self.base_url = base_url.rstrip('/')
+        self.transport = transport or HttpTransport()
         self.proxies = None
         if proxy:
             self.proxies = dict(http=proxy, https=proxy)
         self.user_agent = USER_AGENT
         self.headers = {'User-Agent': self.user_agent}
-        self.logger = print
+        self.logger = logger
+        self.metrics = metrics
 
-    def _log(self, msg):
-        self.logger(msg)
+    def _log(self, msg, level=logging.WARNING):
+        if self.logger is not None:
+            self.logger.log(level, msg)
+        else:
+            print(msg)
 
-    def _req(self, url, max_retries=1, xhr_post=False, stream=False):
+    def _req(self, url, max_retries=1, xhr_post=False, stream=False, kind=None):
         retries = 0
         while retries < max_retries:
+            start = time.perf_counter()
+            response = None
             try:
-                if not xhr_post:
-                    response = requests.get(url,
-                                            headers=self.headers,
-                                            proxies=self.proxies,
-                                            timeout=REQUEST_TIMEOUT,
-                                            stream=stream)
-                else:
-                    headers = self.headers.copy()
-                    headers['X-Requested-With'] = 'XMLHttpRequest'
-                    response = requests.post(url,
-                                             headers=headers,
-                                             proxies=self.proxies,
-                                             timeout=REQUEST_TIMEOUT)
+                with self._track_request(kind):
+                    if not xhr_post:
+                        response = self.transport.request('GET', url,
+                                                          headers=self.headers,
+                                                          proxies=self.proxies,
+                                                          timeout=REQUEST_TIMEOUT,
+                                                          stream=stream)
+                    else:
+                        headers = self.headers.copy()
+                        headers['X-Requested-With'] = 'XMLHttpRequest'
+                        response = self.transport.request('POST', url,
+                                                          headers=headers,
+                                                          proxies=self.proxies,
+                                                          timeout=REQUEST_TIMEOUT)
                 return response
             except requests.exceptions.Timeout:
                 self._log("TELEGRAM WEB - REQUEST TIMEOUT ERROR")
@@ -60,39 +75,87 @@ class TelegramWebClient:
                 self._log("TELEGRAM WEB - JSON DECODE ERROR")
             except Exception as e:
                 self._log(f"TELEGRAM WEB - UNKNOWN ERROR - {e}")
+            finally:
+                self._observe_request(kind, response, time.perf_counter() - start, stream)
             retries += 1
         return None
 
-    def _channel_load_main(self, channel):
-        url = f"https://t.me/s/{channel}"
-        response = self._req(url)
+    def _track_request(self, kind):
+        if self.metrics is None:
+            return nullcontext()
+        return self.metrics.track_request(kind)
+
+    def _observe_request(self, kind, response, elapsed, stream=False):
+        if self.metrics is None:
+            return
+        if response is None:
+            self.metrics.observe_request(kind, None, elapsed)
+            return
+        if stream:
+            size = response.headers.get('Content-Length')
+            size = int(size) if size and size.isdigit() else None
+        else:
+            size = len(response.content)
+        self.metrics.observe_request(kind, response.status_code, elapsed, size)
+
+    def _channel_load_main(self, channel, query=None):
+        url = f"{self.base_url}/s/{channel}"
+        if query:
+            url = f"{url}?{urlencode(dict(q=query))}"
+        response = self._req(url, kind='search' if query else 'feed')
         if response and response.url == url:
             return response.text
         else:
             return None
 
-    def _channel_load_more(self, cursor):
-        url = f"https://t.me{cursor}"
-        response = self._req(url, xhr_post=True)
+    def _channel_load_more(self, cursor, query=None):
+        url = f"{self.base_url}{cursor}"
+        if query and 'q=' not in cursor:
+            url = f"{url}&{urlencode(dict(q=query))}"
+        response = self._req(url, xhr_post=True, kind='search' if query else 'load_more')
         return response.json()
 
-    def load_channel_feed(self, channel, cursor=None):
+    def load_channel_feed(self, channel, cursor=None, query=None):
+        """
+        With a `query` (keyword or #hashtag) loads a page of the in-channel search results
+        instead; they have the feed layout and their own `before` cursor, so the channel
+        parser reads them as it reads the feed.
+        """
         if cursor:
-            return self._channel_load_more(cursor)
+            return self._channel_load_more(cursor, query=query)
         else:
-            return self._channel_load_main(channel)
+            return self._channel_load_main(channel, query=query)
 
     def load_single_post(self, post_url):
         url = f"{post_url}?embed=1&single=1"
-        response = self._req(url)
+        response = self._req(url, kind='single_post')
         return response.text
 
-    def load_multiple_posts(self, post_urls):
+    def load_media(self, media_url):
+        """
+        Returns the streamed response of a media file, the body is left unread.
+        """
+        response = self._req(media_url, stream=True, kind='media')
+        if response is None or response.status_code != 200:
+            if response is not None:
+                response.close()
+            raise TelegramWebBaseException(f"FAILED TO LOAD MEDIA {media_url}")
+        return response
+
+    def load_multiple_posts(self, post_urls, ignore_errors=False):
+        load = self._load_single_post_or_none if ignore_errors else self.load_single_post
         thread_pool = ThreadPoolExecutor()
-        results = list(thread_pool.map(self.load_single_post, post_urls))
+        results = list(thread_pool.map(load, post_urls))
         thread_pool.shutdown(wait=True)
         return results
 
+    def _load_single_post_or_none(self, post_url):
+        try:
+            return self.load_single_post(post_url)
+        except Exception as e:
+            self._log(f"TELEGRAM WEB - FAILED TO LOAD {post_url} - {e}")
+            return None
+
 
 class TelegramWebParserHelpers:
     @staticmethod
@@ -228,7 +291,7 @@ class TelegramWebMessageParser(TelegramWebParserHelpers):
             link = link['href'].split('?')[0]
             channel, message_id = self.extract_channel_and_message_id(link)
         else:
-            channel, message_id = None, None
+            channel, message_id = self.extract_data_post()
 
         if self.soup.find('span', {'class': 'tgme_widget_message_views'}):
             views = self.convert_shorthand_to_number(
@@ -280,6 +343,29 @@ class TelegramWebMessageParser(TelegramWebParserHelpers):
             replies=None
         )
 
+    def extract_views_info(self):
+        """
+        Minimal parser path for engagement refresh: only reads the post link,
+        view counter and publish time, skipping media, album & forward markup.
+        """
+        channel, message_id, publish_datetime = None, None, None
+        date_link = self.soup.find('a', {'class': 'tgme_widget_message_date'})
+        if date_link:
+            channel, message_id = self.extract_channel_and_message_id(date_link['href'].split('?')[0])
+            time_soup = date_link.find('time')
+            if time_soup:
+                publish_datetime = datetime.datetime.strptime(time_soup['datetime'], '%Y-%m-%dT%H:%M:%S%z')
+
+        views_soup = self.soup.find('span', {'class': 'tgme_widget_message_views'})
+        views = self.convert_shorthand_to_number(views_soup.text) if views_soup else 0
+
+        return dict(
+            channel=channel,
+            id=message_id,
+            views=views,
+            publish_datetime=publish_datetime
+        )
+
     def extract_album_info(self):
         album_info = dict(
             is_album=False,
@@ -446,7 +532,15 @@ class TelegramWebMessageParser(TelegramWebParserHelpers):
     def extract_channel_id(self):
         try:
             data_peer = self.soup.find("div", {"class": "tgme_widget_message"})["data-peer"]
-            channel_id = data_peer.split("_")[0][1:]
+            channel_id = data_peer.split("_")[0][1:] or None
         except Exception:
             channel_id = None
         return channel_id
+
+    def extract_data_post(self):
+        try:
+            data_post = self.soup.find("div", {"class": "tgme_widget_message"})["data-post"]
+            channel, message_id = data_post.split("/")
+            return channel, int(message_id)
+        except Exception:
+            return None, None
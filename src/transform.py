@@ -51,3 +51,8 @@ class TransformerMixin:
             data.album_messages = self.get_album_messages(objects)
 
         return data
+
+    def transform_views(self, obj, previous_views=None):
+        data = ViewsDelta()
+        data.format_views_delta(obj, previous_views=previous_views)
+        return data
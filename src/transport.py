@@ -0,0 +1,159 @@
+import gzip
+import json
+import time
+import base64
+import threading
+from datetime import timedelta
+from collections import defaultdict, deque
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+# streamed (media) bodies are only recorded up to this size, larger ones are never read into memory
+MAX_RECORDED_STREAM_BYTES = 1024 * 1024
+# recorded bodies are already decoded, so these would misdescribe them on replay
+DROPPED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+REDACTED_HEADERS = ('set-cookie',)
+
+
+class ReplayMissError(requests.exceptions.RequestException):
+    """
+    Raise when a replayed crawl makes a request the cassette holds no response for
+    """
+
+
+class HttpTransport(object):
+    """
+    Sends the requests of `TelegramWebClient._req` over the network.
+    """
+
+    def request(self, method, url, headers=None, proxies=None, timeout=None, stream=False):
+        return requests.request(method, url,
+                                headers=headers,
+                                proxies=proxies,
+                                timeout=timeout,
+                                stream=stream)
+
+    def close(self):
+        pass
+
+
+class RecordingTransport(HttpTransport):
+    """
+    Sends requests through `transport` and writes every exchange (status, headers, body,
+    final url, timing or the raised exception) to a gzip compressed JSON lines cassette,
+    replacing any previous recording. Encoding & length headers of the decoded bodies are
+    dropped and cookies redacted. Bodies of streamed responses without a known size
+    within `max_stream_bytes` are left out and the caller keeps streaming them.
+    """
+
+    def __init__(self, cassette, transport=None, max_stream_bytes=MAX_RECORDED_STREAM_BYTES):
+        self.transport = transport or HttpTransport()
+        self.max_stream_bytes = max_stream_bytes
+        self.cassette = gzip.open(cassette, 'wt', encoding='utf-8')
+        self.lock = threading.Lock()
+
+    def request(self, method, url, headers=None, proxies=None, timeout=None, stream=False):
+        entry = dict(method=method, url=url)
+        start = time.perf_counter()
+        try:
+            response = self.transport.request(method, url,
+                                              headers=headers,
+                                              proxies=proxies,
+                                              timeout=timeout,
+                                              stream=stream)
+            entry.update(
+                status=response.status_code,
+                headers=self._recorded_headers(response.headers),
+                final_url=response.url
+            )
+            if not stream or self._recordable_stream(response):
+                # reading the body here keeps it available to the caller, streamed or not
+                entry['body'] = base64.b64encode(response.content).decode()
+            return response
+        except Exception as e:
+            entry['error'] = e.__class__.__name__
+            entry['message'] = str(e)
+            raise
+        finally:
+            entry['elapsed'] = time.perf_counter() - start
+            self._write(entry)
+
+    @staticmethod
+    def _recorded_headers(headers):
+        recorded = dict()
+        for name, value in headers.items():
+            if name.lower() in DROPPED_HEADERS:
+                continue
+            recorded[name] = '[REDACTED]' if name.lower() in REDACTED_HEADERS else value
+        return recorded
+
+    def _recordable_stream(self, response):
+        size = response.headers.get('Content-Length')
+        return bool(size) and size.isdigit() and int(size) <= self.max_stream_bytes
+
+    def _write(self, entry):
+        with self.lock:
+            self.cassette.write(json.dumps(entry) + '\n')
+            self.cassette.flush()
+
+    def close(self):
+        with self.lock:
+            self.cassette.close()
+
+
+class ReplayTransport(HttpTransport):
+    """
+    Answers requests from a cassette without touching the network. Exchanges are replayed
+    per (method, url) in recording order; with `realtime` the recorded latency is kept.
+    """
+
+    def __init__(self, cassette, realtime=False):
+        self.realtime = realtime
+        self.lock = threading.Lock()
+        self.exchanges = defaultdict(deque)
+        self.replayed = 0
+        self.misses = 0
+        with gzip.open(cassette, 'rt', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                self.exchanges[(entry['method'], entry['url'])].append(entry)
+
+    def request(self, method, url, headers=None, proxies=None, timeout=None, stream=False):
+        with self.lock:
+            queue = self.exchanges.get((method, url))
+            if not queue:
+                self.misses += 1
+                raise ReplayMissError(f'{method} {url} is not in the cassette')
+            entry = queue.popleft()
+            if 'error' not in entry and 'body' not in entry:
+                self.misses += 1
+                raise ReplayMissError(f'{method} {url} was streamed, its body is not in the cassette')
+            self.replayed += 1
+        if self.realtime:
+            time.sleep(entry['elapsed'])
+        if 'error' in entry:
+            exception = getattr(requests.exceptions, entry['error'], requests.exceptions.RequestException)
+            raise exception(entry['message'])
+        return self._response(entry)
+
+    @staticmethod
+    def _response(entry):
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.url = entry['final_url']
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.elapsed = timedelta(seconds=entry['elapsed'])
+        response._content = base64.b64decode(entry['body'])
+        response._content_consumed = True
+        return response
+
+
+def make_transport(mode='live', cassette=None, realtime=False):
+    if mode == 'record':
+        return RecordingTransport(cassette)
+    if mode == 'replay':
+        return ReplayTransport(cassette, realtime=realtime)
+    return HttpTransport()